@@ -6,10 +6,11 @@
 # Description:  This file contains the primary codebase of the ABM modeling,
 #               defining the agents and the model.
 
-import time
+import math, os, time, uuid
 import mesa
 import numpy as np
-from Utilities import get_locs, euclidean_distance
+from Utilities import get_locs, get_next_step_field, is_steady_state
+from TrajectoryRecorder import TrajectoryRecorder, INITIAL_CAPACITY
 
 # MESA GRID CONVENTION
 #   |
@@ -24,6 +25,7 @@ from Utilities import get_locs, euclidean_distance
 GRID_WIDTH = 20
 GRID_HEIGHT = 24
 MINUTES_PER_TICK = 15
+TICKS_PER_DAY = int((24 * 60) / MINUTES_PER_TICK)
 # Ticks per average mouse arrival
 MAX_MOUSE_GROWTH_RATE = (48 * 60) / MINUTES_PER_TICK
 MATING_PROBABILITY = .8
@@ -36,6 +38,9 @@ KITTEN_LITTER_MAX = 6
 # assume this is around 6 hours). Must be negative as this is the time elapsed
 # since they became hungry.
 FOOD_THRESHOLD = -1 * (360 / MINUTES_PER_TICK)
+# Collected series checked for steady state (all must be steady), using daily
+# batch means
+STEADY_STATE_STATS = ["Cat Pop.", "Mice Pop."]
 
 
 class StreetAgent(mesa.Agent):
@@ -140,11 +145,13 @@ class CatAgent(mesa.Agent):
                 self.found_food_type = type(neighbor)
                 break
 
+        # Head back towards the last place food was found (one lookup in a
+        # field shared by all cats); if already there, search at random
         if new_loc is None and self.last_food_loc is not None and \
             self.ticks_until_hungry < FOOD_THRESHOLD and not self.go_wander:
-            new_loc = min([(loc, euclidean_distance(self.pos, loc)) \
-                for loc in self.model.grid.get_neighborhood(self.pos, True)],
-                key=lambda x : x[1])[0]
+            new_loc = get_next_step_field(self.last_food_loc,
+                self.model.grid.width, self.model.grid.height)[
+                self.pos[0]][self.pos[1]]
 
         if self.ticks_until_hungry < -96:
             self.go_wander = True
@@ -411,7 +418,10 @@ class_map = {
 class CatModel(mesa.Model):
     def __init__(self, cat_removal_rate, num_cats, hunger_rate, sleep_rate,
         sleep_duration_rate, house_willingness, house_rate, initial_mice_pop,
-        mouse_growth_rate, save_out, save_frequency, car_hit_prob, seed=None):
+        mouse_growth_rate, save_out, save_frequency, car_hit_prob,
+        record_trajectories=False, trajectory_frequency=1,
+        stop_on_extinction=False, max_cat_pop=0, steady_state_days=0,
+        max_steps=None, seed=None):
 
         if seed is not None:
             np.random.seed(seed)
@@ -437,6 +447,11 @@ class CatModel(mesa.Model):
 
         # REQUIRED FOR USE WITH BATCH RUN
         self.running = True
+        # STOPPING RULES (see check_stopping_rules)
+        self.stop_on_extinction = stop_on_extinction
+        self.max_cat_pop = max_cat_pop
+        self.steady_state_days = steady_state_days
+        self.stop_reason = None
 
         # Maintain a list of the cats - MUST be updated by reproduction
         self.cat_list = []
@@ -487,9 +502,52 @@ class CatModel(mesa.Model):
                                 "Cats Removed"  : get_cats_removed_under_policy,
                                 "Cat Fights"    : get_cat_fights})
 
+        # Optional agent-level recording (one file per model instance, as
+        # batch runs may run many instances at once). When the number of
+        # steps is known (max_steps, as in batch runs) the file is sized for
+        # the whole run up front, for the population cap if there is one, so
+        # it only grows mid-run if the population exceeds that.
+        self.max_steps = max_steps
+        self.trajectory_frequency = trajectory_frequency
+        self.trajectory_recorder = None
+        if record_trajectories:
+            capacity = INITIAL_CAPACITY if max_steps is None else \
+                (math.ceil((max_steps + 1) / trajectory_frequency) *
+                max(max_cat_pop, num_cats, 1))
+            self.trajectory_recorder = TrajectoryRecorder(os.path.join(
+                "Results", "Trajectories", self.file_datetime + "seed_" +
+                str(seed) + "_" + uuid.uuid4().hex[:8] + "_trajectories.dat"),
+                capacity)
+
+    # Checked on the state just collected, so that the last collected values
+    # are those of the state that stopped the run (the step itself still
+    # completes)
+    def check_stopping_rules(self):
+        model_vars = self.datacollector.model_vars
+        if self.stop_on_extinction and not self.cat_list and \
+            not [t for t in self.kitten_queue if t > self.current_tick]:
+            self.stop_reason = "extinction"
+        elif self.max_cat_pop and self.num_cats >= self.max_cat_pop:
+            self.stop_reason = "population cap"
+        elif self.steady_state_days and \
+            len(model_vars["Cat Pop."]) % TICKS_PER_DAY == 0 and \
+            all([is_steady_state(model_vars[stat], TICKS_PER_DAY,
+                self.steady_state_days) for stat in STEADY_STATE_STATS]):
+            self.stop_reason = "steady state"
+        self.running = self.stop_reason is None
+
+    def close_trajectory_recorder(self):
+        if self.trajectory_recorder is not None:
+            self.trajectory_recorder.close()
+            self.trajectory_recorder = None
+
     def step(self):
         """Advance the model by one step."""
         self.datacollector.collect(self)
+        if self.trajectory_recorder is not None and \
+            self.current_tick % self.trajectory_frequency == 0:
+            self.trajectory_recorder.record(self.current_tick, self.cat_list)
+        self.check_stopping_rules()
         self.schedule.step()
         self.current_tick += 1
 
@@ -518,6 +576,11 @@ class CatModel(mesa.Model):
                 self.grid.place_agent(curr_a, (x, y))
                 self.cat_list.append(curr_a)
                 self.num_cats += 1
+
+        # Finished: stopped, or (for batch runs) past the last step
+        if not self.running or (self.max_steps is not None and
+            self.schedule.steps > self.max_steps):
+            self.close_trajectory_recorder()
         #print(len(self.cat_list))
         #print(self.cat_fights)
 
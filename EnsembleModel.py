@@ -0,0 +1,683 @@
+# File:         EnsembleModel.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the batched ensemble engine: R replications
+#               of the same scenario advanced together, with all cat,
+#               house and restaurant state held in NumPy arrays that have a
+#               replication dimension, instead of one Python object per agent.
+#
+# The dynamics mirror CatModel.py. The one structural difference is that,
+# within a tick, all cats update, then all move, then all act (rather than
+# each cat doing all three in a random order), so results are statistically -
+# not draw for draw - equivalent to the reference model. Every replication
+# draws from its own generator, and the number of draws it makes depends only
+# on its own state, so a replication's results do not depend on which (or how
+# many) other replications it is run with.
+
+import functools
+import numpy as np
+from CatModel import GRID_WIDTH, GRID_HEIGHT, MINUTES_PER_TICK, \
+    MAX_MOUSE_GROWTH_RATE, MATING_PROBABILITY, TICKS_UNTIL_BIRTH, \
+    TICKS_UNTIL_MATURE, KITTEN_LITTER_MIN, KITTEN_LITTER_MAX, FOOD_THRESHOLD, \
+    TICKS_PER_DAY, STEADY_STATE_STATS
+from Utilities import get_locs, is_steady_state
+
+# Cell types
+STREET, HOUSE, BACKYARD, SHOP, RESTAURANT = range(5)
+zone_codes = {
+    "street" : STREET,
+    "house" : HOUSE,
+    "backyard" : BACKYARD,
+    "shop" : SHOP,
+    "restaurant" : RESTAURANT
+}
+
+# Moore neighborhood offsets, with and without the center
+NEIGHBORHOOD_DX = np.array([dx for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+NEIGHBORHOOD_DY = np.array([dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+MOVE_DX = NEIGHBORHOOD_DX[NEIGHBORHOOD_DX ** 2 + NEIGHBORHOOD_DY ** 2 > 0]
+MOVE_DY = NEIGHBORHOOD_DY[NEIGHBORHOOD_DX ** 2 + NEIGHBORHOOD_DY ** 2 > 0]
+
+# Per cat state: name -> (dtype, value of unused slots)
+CAT_FIELDS = {
+    "alive" : (np.bool_, False),
+    "unique_id" : (np.int64, 0),
+    "sex" : (np.bool_, False), # True=male,False=female
+    "aggressiveness" : (np.float64, 0),
+    "pregnant" : (np.bool_, False),
+    "ticks_until_birth" : (np.float64, np.nan), # NaN when not pregnant
+    "hunger_rate" : (np.int64, 0),
+    "is_hungry" : (np.bool_, False),
+    "ticks_until_hungry" : (np.int64, 0),
+    "last_food_x" : (np.int64, -1), # -1 when no food found yet
+    "last_food_y" : (np.int64, -1),
+    "go_wander" : (np.bool_, False),
+    "sleepy_rate" : (np.int64, 0),
+    "is_asleep" : (np.bool_, False),
+    "is_sleepy" : (np.bool_, False),
+    "ticks_until_sleepy" : (np.int64, 0),
+    "ticks_until_awake" : (np.int64, 0),
+    "hunt_ability" : (np.float64, 0),
+    "x" : (np.int64, 0),
+    "y" : (np.int64, 0)
+}
+
+REPORTERS = ["Hunger", "Mice Pop.", "Max Hunger", "Cat Pop.", "Cats Pregnant",
+    "Cats Hit", "Cats Removed", "Cat Fights"]
+
+# Uniform draws made per cat per tick, one row each
+U_LITTER, U_MATE_CELL, U_MATE_PICK, U_WANDER, U_CAR, U_ENCOUNTER, \
+    U_FIGHT_PICK, U_VIOLENT, U_MATING, U_HUNT = range(10)
+NUM_UNIFORMS = 10
+# Poisson draws made per cat per tick (time until sleepy, time until awake,
+# time until hungry), one row each
+P_SLEEPY, P_AWAKE, P_HUNGRY = range(3)
+
+# Each cell's 8 neighbors (as cell indices, x * height + y), in sorted order,
+# shape (cells, 8)
+@functools.lru_cache(maxsize=None)
+def get_neighbor_cells(width, height):
+    cells = np.arange(width * height, dtype=np.int32)
+    x, y = cells // height, cells % height
+    neighbors = (((x[:, None] + MOVE_DX) % width) * height) + \
+        ((y[:, None] + MOVE_DY) % height)
+    return np.sort(neighbors, axis=1).astype(np.int32)
+
+# Next step towards the target cell from every cell (as cell indices; -1 at
+# the target itself), built once per target and shared by all models.
+# Matches Utilities.get_next_step_field: the fewest moves, then the shortest
+# straight line, then the first in sorted order.
+@functools.lru_cache(maxsize=None)
+def get_next_step_row(target, width, height):
+    neighbors = get_neighbor_cells(width, height)
+    dx = np.abs((neighbors // height) - (target // height))
+    dy = np.abs((neighbors % height) - (target % height))
+    dx = np.minimum(dx, width - dx)
+    dy = np.minimum(dy, height - dy)
+    distance = (np.maximum(dx, dy) * ((width ** 2) + (height ** 2) + 1)) + \
+        (dx ** 2) + (dy ** 2)
+    row = np.take_along_axis(neighbors, distance.argmin(axis=1)[:, None],
+        axis=1)[:, 0]
+    row[target] = -1
+    return row
+
+# Kittens are queued TICKS_UNTIL_MATURE ahead, so a ring buffer this long
+# holds every pending litter
+KITTEN_QUEUE_LENGTH = int(TICKS_UNTIL_MATURE) + 2
+
+class EnsembleModel:
+    # Takes the same parameters as CatModel, except that a list of seeds
+    # (one replication per seed, None for an unseeded replication) replaces
+    # the single seed. save_out and save_frequency are accepted so the same
+    # parameter dictionaries can be used, but are ignored.
+    def __init__(self, cat_removal_rate, num_cats, hunger_rate, sleep_rate,
+        sleep_duration_rate, house_willingness, house_rate, initial_mice_pop,
+        mouse_growth_rate, save_out, save_frequency, car_hit_prob,
+        record_trajectories=False, trajectory_frequency=1,
+        stop_on_extinction=False, max_cat_pop=0, steady_state_days=0,
+        seeds=(None,)):
+
+        if record_trajectories:
+            raise ValueError("Trajectory recording is only supported by " +
+                "CatModel")
+
+        self.seeds = list(seeds)
+        self.num_reps = len(self.seeds)
+        self.gens = [np.random.default_rng(seed) for seed in self.seeds]
+        self.rep_idx = np.arange(self.num_reps)[:, None]
+
+        self.current_tick = 1 # Time tracking for policies
+        self.steps = 0
+        self.cat_removal_rate = ((cat_removal_rate * 60) / MINUTES_PER_TICK)
+        self.hunger_lam = (hunger_rate * 60) / MINUTES_PER_TICK
+        self.sleep_lam = (sleep_rate * 60) / MINUTES_PER_TICK
+        # Average time asleep (for all cats, not personalized)
+        self.sleep_duration_rate = \
+            ((sleep_duration_rate * 60) / MINUTES_PER_TICK)
+        self.car_hit_prob = car_hit_prob
+
+        # STOPPING RULES (as in CatModel, per replication). A stopped
+        # replication is frozen: its cats are removed and it makes no more
+        # draws, and only its results up to last_step are reported.
+        self.stop_on_extinction = stop_on_extinction
+        self.max_cat_pop = max_cat_pop
+        self.steady_state_days = steady_state_days
+        self.running = np.ones(self.num_reps, dtype=np.bool_)
+        self.last_step = np.full(self.num_reps, -1)
+        self.stop_reasons = [None] * self.num_reps
+
+        self.width = GRID_WIDTH
+        self.height = GRID_HEIGHT
+
+        # Per replication counters
+        self.cat_fights = np.zeros(self.num_reps, dtype=np.int64)
+        self.num_cats_hit_by_car = np.zeros(self.num_reps, dtype=np.int64)
+        self.num_cats_removed_under_policy = np.zeros(self.num_reps,
+            dtype=np.int64)
+        self.kitten_queue = np.zeros((self.num_reps, KITTEN_QUEUE_LENGTH),
+            dtype=np.int64)
+        self.next_id = np.ones(self.num_reps, dtype=np.int64)
+
+        # CATS
+        # Slots [0, used) of each replication's row hold its cats (alive or
+        # dead); the capacity is shared by all replications
+        self.capacity = max(1, num_cats)
+        self.used = np.zeros(self.num_reps, dtype=np.int64)
+        self.cats = {k : np.full((self.num_reps, self.capacity), fill,
+            dtype=dtype) for k, (dtype, fill) in CAT_FIELDS.items()}
+        for r in range(self.num_reps):
+            self.add_cats(r, num_cats)
+
+        # GRID / ENVIRONMENTAL SETUP
+        shape = (self.num_reps, self.width, self.height)
+        self.cell_type = np.zeros(shape, dtype=np.int64)
+        self.puts_food = np.zeros(shape, dtype=np.bool_)
+        self.food = np.zeros(shape, dtype=np.bool_)
+        self.food_p = np.zeros(shape)
+        self.mice_pop = np.zeros(shape, dtype=np.int64)
+        self.mouse_growth_rate = np.zeros(shape)
+        self.ticks_until_new_mouse = np.zeros(shape, dtype=np.int64)
+        self.mice_caught = np.zeros(shape, dtype=np.int64)
+        self.mouse_prob = np.zeros(shape)
+        for r, gen in enumerate(self.gens):
+            environment = get_locs(gen, self.width, self.height)
+            for zone_type, locs in environment.items():
+                xs, ys = (np.array(c) for c in zip(*locs))
+                self.cell_type[r, xs, ys] = zone_codes[zone_type]
+
+            houses = self.cell_type[r] == HOUSE
+            n = houses.sum()
+            puts_food = gen.random(n) < house_willingness
+            rate = 1 + gen.poisson(house_rate, n)
+            self.puts_food[r][houses] = puts_food
+            self.food[r][houses] = puts_food
+            self.food_p[r][houses] = np.where(puts_food,
+                1 / ((rate * 60) / MINUTES_PER_TICK), 0)
+
+            restaurants = self.cell_type[r] == RESTAURANT
+            n = restaurants.sum()
+            mice_pop = 1 + gen.poisson(initial_mice_pop, n)
+            growth_rate = gen.poisson(
+                (mouse_growth_rate * 60) / MINUTES_PER_TICK, n)
+            self.mice_pop[r][restaurants] = mice_pop
+            self.mouse_growth_rate[r][restaurants] = growth_rate
+            self.ticks_until_new_mouse[r][restaurants] = \
+                gen.poisson(growth_rate)
+            # Probability of Interaction
+            self.mouse_prob[r][restaurants] = mice_pop / 100
+
+        self.is_restaurant = self.cell_type == RESTAURANT
+
+        # Next steps towards the cells where cats can find food (houses and
+        # restaurants, in any replication), one row per food cell, filled in
+        # the first time a cat heads back to it
+        food_cells = np.nonzero(((self.cell_type == HOUSE) |
+            self.is_restaurant).any(axis=0).reshape(-1))[0]
+        self.food_cells = food_cells
+        self.food_row = np.full(self.width * self.height, -1, dtype=np.int32)
+        self.food_row[food_cells] = np.arange(len(food_cells))
+        self.next_step = np.empty((len(food_cells), self.width * self.height),
+            dtype=np.int32)
+        self.next_step_built = np.zeros(len(food_cells), dtype=np.bool_)
+        self.model_vars = {k : [] for k in REPORTERS}
+
+    # RANDOM DRAWS
+    # All of a tick's per cat draws are made up front, with one call per
+    # distribution per replication (the per call overhead otherwise
+    # dominates). Each replication only draws for its own used slots, from
+    # its own generator. The Poisson rates are all fixed per cat, so draws
+    # are made for every cat whether or not they end up being used.
+    def draw(self):
+        c = self.cats
+        self.u = np.zeros((NUM_UNIFORMS, self.num_reps, self.capacity))
+        self.u_grid = np.zeros((self.num_reps, self.width, self.height))
+        self.p = np.zeros((3, self.num_reps, self.capacity), dtype=np.int64)
+        lam = np.stack([c["sleepy_rate"], np.full(c["sleepy_rate"].shape,
+            self.sleep_duration_rate), c["hunger_rate"]])
+        for r, gen in enumerate(self.gens):
+            if not self.running[r]:
+                continue
+            n = self.used[r]
+            u = gen.random((NUM_UNIFORMS * n) + (self.width * self.height))
+            self.u[:, r, :n] = u[:NUM_UNIFORMS * n].reshape(NUM_UNIFORMS, n)
+            self.u_grid[r] = u[NUM_UNIFORMS * n:].reshape(self.width,
+                self.height)
+            self.p[:, r, :n] = gen.poisson(lam[:, r, :n])
+
+    # CAT SLOTS
+    def ensure_capacity(self, needed):
+        if needed <= self.capacity:
+            return
+        extra = max(needed, 2 * self.capacity) - self.capacity
+        for k, (dtype, fill) in CAT_FIELDS.items():
+            self.cats[k] = np.concatenate([self.cats[k], np.full(
+                (self.num_reps, extra), fill, dtype=dtype)], axis=1)
+        self.capacity += extra
+
+    def compact(self, r):
+        # Move the replication's live cats to the front of its row
+        used = self.used[r]
+        order = np.argsort(~self.cats["alive"][r, :used], kind="stable")
+        num_alive = self.cats["alive"][r, :used].sum()
+        for k, (dtype, fill) in CAT_FIELDS.items():
+            self.cats[k][r, :used] = self.cats[k][r, order]
+            self.cats[k][r, num_alive:used] = fill
+        self.used[r] = num_alive
+
+    def add_cats(self, r, n):
+        c = self.cats
+        used = self.used[r]
+        # Reclaim dead slots once they outnumber the live ones (depends only
+        # on this replication, like everything affecting its draws)
+        if used - c["alive"][r, :used].sum() > c["alive"][r, :used].sum():
+            self.compact(r)
+            used = self.used[r]
+        self.ensure_capacity(used + n)
+
+        gen = self.gens[r]
+        s = slice(used, used + n)
+        sex = (np.arange(n) % 2) == 0
+        c["alive"][r, s] = True
+        c["unique_id"][r, s] = np.arange(self.next_id[r], self.next_id[r] + n)
+        self.next_id[r] += n
+        c["sex"][r, s] = sex
+        c["aggressiveness"][r, s] = np.where(sex, gen.random(n), 0)
+        c["pregnant"][r, s] = False
+        c["ticks_until_birth"][r, s] = np.nan
+
+        # FOOD
+        hunger_rate = gen.poisson(self.hunger_lam, n)
+        is_hungry = gen.random(n) < 0.2
+        c["hunger_rate"][r, s] = hunger_rate
+        c["is_hungry"][r, s] = is_hungry
+        c["ticks_until_hungry"][r, s] = np.where(is_hungry, 0,
+            gen.poisson(hunger_rate))
+        c["last_food_x"][r, s] = -1
+        c["last_food_y"][r, s] = -1
+        c["go_wander"][r, s] = False
+
+        # SLEEP
+        sleepy_rate = 1 + gen.poisson(self.sleep_lam, n)
+        is_asleep = gen.random(n) < 0.2
+        is_sleepy = ~is_asleep & (gen.random(n) < 0.2)
+        c["sleepy_rate"][r, s] = sleepy_rate
+        c["is_asleep"][r, s] = is_asleep
+        c["is_sleepy"][r, s] = is_sleepy
+        c["ticks_until_sleepy"][r, s] = np.where(is_sleepy | is_asleep, 0,
+            gen.poisson(sleepy_rate))
+        c["ticks_until_awake"][r, s] = np.where(is_asleep,
+            gen.poisson(self.sleep_duration_rate, n), 0)
+
+        c["hunt_ability"][r, s] = gen.uniform(0.5, 1, n)
+        c["x"][r, s] = gen.integers(self.width, size=n)
+        c["y"][r, s] = gen.integers(self.height, size=n)
+        self.used[r] += n
+
+    def kill(self, mask):
+        self.cats["alive"] &= ~mask
+
+    def cell_key(self, x, y):
+        # Unique (per replication) cell index
+        return (((self.rep_idx * self.width) + x) * self.height) + y
+
+    # STEPS
+    def collect(self):
+        c = self.cats
+        alive = c["alive"]
+        num_cats = alive.sum(axis=1)
+        self.model_vars["Hunger"].append(np.where(num_cats > 0,
+            (alive & c["is_hungry"]).sum(axis=1) / np.maximum(num_cats, 1),
+            0))
+        self.model_vars["Mice Pop."].append(
+            (self.mice_pop * self.is_restaurant).sum(axis=(1, 2)))
+        self.model_vars["Max Hunger"].append(np.where(num_cats > 0,
+            np.where(alive, c["ticks_until_hungry"],
+            np.iinfo(np.int64).max).min(axis=1, initial=np.iinfo(
+            np.int64).max), 0))
+        self.model_vars["Cat Pop."].append(num_cats)
+        self.model_vars["Cats Pregnant"].append(
+            (alive & c["pregnant"]).sum(axis=1))
+        self.model_vars["Cats Hit"].append(self.num_cats_hit_by_car.copy())
+        self.model_vars["Cats Removed"].append(
+            self.num_cats_removed_under_policy.copy())
+        self.model_vars["Cat Fights"].append(self.cat_fights.copy())
+
+    def step_environment(self):
+        # Houses put food back out
+        refill = self.puts_food & ~self.food & (self.u_grid < self.food_p)
+        self.food |= refill
+
+        # Restaurants gain mice
+        self.ticks_until_new_mouse -= self.is_restaurant
+        new_mouse = self.is_restaurant & (self.ticks_until_new_mouse <= 0) & \
+            self.running[:, None, None]
+        self.mice_pop += new_mouse
+        self.mouse_growth_rate = np.where(new_mouse, np.maximum(
+            self.mouse_growth_rate - 1, MAX_MOUSE_GROWTH_RATE),
+            self.mouse_growth_rate)
+        self.mouse_prob = np.where(new_mouse,
+            np.minimum(1, self.mice_pop / 100), self.mouse_prob)
+        # New mice are rare, so these are drawn only where needed
+        for r in np.nonzero(new_mouse.any(axis=(1, 2)))[0]:
+            self.ticks_until_new_mouse[r][new_mouse[r]] = \
+                self.gens[r].poisson(self.mouse_growth_rate[r][new_mouse[r]])
+
+    def update_state(self):
+        c = self.cats
+        alive = c["alive"]
+
+        # Sleep
+        asleep = alive & c["is_asleep"]
+        awake = alive & ~c["is_asleep"]
+        c["ticks_until_awake"] -= asleep
+        wake = asleep & (c["ticks_until_awake"] <= 0)
+        c["ticks_until_sleepy"] -= awake
+        sleep = awake & (c["ticks_until_sleepy"] <= 0)
+        c["is_asleep"] = (c["is_asleep"] & ~wake) | sleep
+        c["is_sleepy"] = (c["is_sleepy"] & ~wake) | sleep
+        c["ticks_until_sleepy"] = np.where(wake, self.p[P_SLEEPY],
+            c["ticks_until_sleepy"])
+        c["ticks_until_awake"] = np.where(sleep, self.p[P_AWAKE],
+            c["ticks_until_awake"])
+
+        # Hunger
+        c["ticks_until_hungry"] -= alive
+        c["is_hungry"] |= alive & (c["ticks_until_hungry"] <= 0)
+
+        # Births (queue up kittens)
+        expecting = alive & ~np.isnan(c["ticks_until_birth"])
+        c["ticks_until_birth"] = np.where(expecting,
+            c["ticks_until_birth"] - 1, c["ticks_until_birth"])
+        due = expecting & (c["ticks_until_birth"] <= 0)
+        litters = KITTEN_LITTER_MIN + (self.u[U_LITTER] *
+            (KITTEN_LITTER_MAX + 1 - KITTEN_LITTER_MIN)).astype(np.int64)
+        self.kitten_queue[:, int(self.current_tick + TICKS_UNTIL_MATURE) %
+            KITTEN_QUEUE_LENGTH] += (litters * due).sum(axis=1)
+        c["ticks_until_birth"][due] = np.nan
+        c["pregnant"][due] = False
+
+    def move(self):
+        c = self.cats
+        x, y = c["x"], c["y"]
+        num_cells = self.width * self.height
+        active = c["alive"] & ~c["is_asleep"]
+        hungry = active & c["is_hungry"]
+
+        # Neighborhoods (including the center) as cell indices (x * height +
+        # y), which also sort the way the reference's coordinates do; shape
+        # (reps, cats, 9)
+        cells = (((x[..., None] + NEIGHBORHOOD_DX) % self.width) *
+            self.height) + ((y[..., None] + NEIGHBORHOOD_DY) % self.height)
+        rep_cells = (self.rep_idx[..., None] * num_cells) + cells
+
+        # Hungry: food within radius 1, taking the first cell in the
+        # reference's search order
+        has_mice = self.is_restaurant & (self.mice_pop > 0)
+        food_near = self.food.reshape(-1)[rep_cells] | \
+            (has_mice.reshape(-1)[rep_cells] & ~c["go_wander"][..., None])
+        found = hungry & food_near.any(axis=2)
+        food_cell = np.where(food_near, cells, num_cells).min(axis=2)
+
+        # Otherwise head back towards known food, unless already there
+        knows_food = hungry & ~found & (c["last_food_x"] >= 0)
+        idx = np.nonzero(knows_food)
+        rows = self.food_row[(c["last_food_x"][idx] * self.height) +
+            c["last_food_y"][idx]]
+        built = self.next_step_built[rows]
+        if not built.all():
+            for row in np.unique(rows[~built]):
+                self.next_step[row] = get_next_step_row(
+                    int(self.food_cells[row]), self.width, self.height)
+                self.next_step_built[row] = True
+        home_cell = np.full(x.shape, -1, dtype=np.int32)
+        home_cell[idx] = self.next_step[rows, (x[idx] * self.height) + y[idx]]
+        homing = knows_food & (c["ticks_until_hungry"] < FOOD_THRESHOLD) & \
+            ~c["go_wander"] & (home_cell >= 0)
+        home_x, home_y = home_cell // self.height, home_cell % self.height
+        c["go_wander"] |= hungry & (c["ticks_until_hungry"] < -96)
+
+        # Not hungry (or pregnant): an awake, not pregnant cat of the opposite
+        # sex within radius 1, chosen uniformly
+        eligible = active & ~c["pregnant"]
+        keys = (((self.rep_idx * 2) + c["sex"]) * num_cells) + \
+            (x * self.height) + y
+        counts = np.bincount(keys[eligible],
+            minlength=self.num_reps * 2 * num_cells)
+        other_sex_base = ((self.rep_idx * 2) + ~c["sex"]) * num_cells
+        mate_counts = counts[other_sex_base[..., None] + cells]
+        total = mate_counts.sum(axis=2)
+        seeking = active & ~c["is_hungry"] & ~c["pregnant"] & (total > 0)
+        target = (np.cumsum(mate_counts, axis=2) >
+            (self.u[U_MATE_CELL] * total)[..., None]).argmax(axis=2)
+        mate_cell = np.take_along_axis(cells, target[..., None],
+            axis=2)[..., 0]
+
+        self.chosen_mate = np.full(x.shape, -1)
+        if seeking.any():
+            order = np.argsort(keys[eligible], kind="stable")
+            sorted_keys = keys[eligible][order]
+            sorted_slots = np.nonzero(eligible)[1][order]
+            mate_keys = (other_sex_base + mate_cell)[seeking]
+            start = np.searchsorted(sorted_keys, mate_keys)
+            n = counts[mate_keys]
+            pick = start + np.minimum(
+                (self.u[U_MATE_PICK][seeking] * n).astype(np.int64), n - 1)
+            self.chosen_mate[seeking] = sorted_slots[pick]
+
+        # Everyone else wanders
+        wander = active & ~found & ~homing & ~seeking
+        k = (self.u[U_WANDER] * len(MOVE_DX)).astype(np.int64)
+        wander_x = (x + MOVE_DX[k]) % self.width
+        wander_y = (y + MOVE_DY[k]) % self.height
+
+        c["x"] = np.select([found, homing, seeking, wander],
+            [food_cell // self.height, home_x, mate_cell // self.height,
+            wander_x], x)
+        c["y"] = np.select([found, homing, seeking, wander],
+            [food_cell % self.height, home_y, mate_cell % self.height,
+            wander_y], y)
+        self.found_food = found
+        self.seeking_mate = seeking
+
+    def run_from_fight(self, r, cat, other, occupied):
+        # BOTH CATS RUN TO RANDOM LOCATION (with no cat in it)
+        x, y = self.cats["x"][r, cat], self.cats["y"][r, cat]
+        run_locations = []
+        radius_to_run = 3
+        while len(run_locations) < 2:
+            run_locations = sorted({((x + dx) % self.width,
+                (y + dy) % self.height)
+                for dx in range(-radius_to_run, radius_to_run + 1)
+                for dy in range(-radius_to_run, radius_to_run + 1)
+                if (dx, dy) != (0, 0)})
+            run_locations = [loc for loc in run_locations
+                if not occupied[loc]]
+            radius_to_run += 1
+        for a, i in zip((cat, other),
+            self.gens[r].integers(len(run_locations), size=2)):
+            occupied[self.cats["x"][r, a], self.cats["y"][r, a]] -= 1
+            self.cats["x"][r, a], self.cats["y"][r, a] = run_locations[i]
+            occupied[run_locations[i]] += 1
+
+    def act(self):
+        c = self.cats
+        rr = self.rep_idx
+        active = c["alive"] & ~c["is_asleep"]
+        cell = self.cell_type[rr, c["x"], c["y"]]
+
+        # On street: gets hit by car?
+        hit = active & (cell == STREET) & (self.u[U_CAR] < self.car_hit_prob)
+        self.kill(hit)
+        self.num_cats_hit_by_car += hit.sum(axis=1)
+        active &= ~hit
+
+        # Encountered other (awake) male cat?
+        cell_keys = self.cell_key(c["x"], c["y"])
+        num_cells = self.num_reps * self.width * self.height
+        males = active & c["sex"]
+        male_counts = np.bincount(cell_keys[males], minlength=num_cells)
+        female_counts = np.bincount(cell_keys[active & ~c["sex"]],
+            minlength=num_cells)
+        other_males = np.maximum(male_counts[cell_keys] - 1, 0)
+        encounter = males & (other_males > 0) & \
+            (self.u[U_ENCOUNTER] < 1 - (1 / (1 + other_males)))
+        fought = np.zeros(active.shape, dtype=np.bool_)
+        if encounter.any():
+            # Which cat: uniformly among the other males in the cell
+            order = np.argsort(cell_keys[males], kind="stable")
+            sorted_keys = cell_keys[males][order]
+            sorted_slots = np.nonzero(males)[1][order]
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            position = np.full(active.shape, -1)
+            position[males] = rank
+            start = np.searchsorted(sorted_keys, cell_keys[encounter])
+            j = (self.u[U_FIGHT_PICK][encounter] * other_males[encounter]).astype(np.int64)
+            j += j >= (position[encounter] - start)
+            other = sorted_slots[start + j]
+            reps = np.nonzero(encounter)[0]
+            # Violent?
+            violent_prob = (c["aggressiveness"][encounter] +
+                c["aggressiveness"][reps, other] +
+                (female_counts[cell_keys[encounter]] > 0)) / 3
+            violent = self.u[U_VIOLENT][encounter] < violent_prob * .3
+
+            # Fights are rare, so are resolved one at a time
+            occupied = np.bincount(cell_keys[c["alive"]],
+                minlength=num_cells).reshape(self.num_reps, self.width,
+                self.height)
+            for r, cat, o in zip(reps[violent],
+                np.nonzero(encounter)[1][violent], other[violent]):
+                if fought[r, cat] or fought[r, o]:
+                    continue
+                self.cat_fights[r] += 1
+                fought[r, cat] = fought[r, o] = True
+                self.run_from_fight(r, cat, o, occupied[r])
+        active &= ~fought
+
+        # Came here to reproduce?
+        mated = active & self.seeking_mate & \
+            (self.u[U_MATING] < MATING_PROBABILITY)
+        mothers = np.where(c["sex"], self.chosen_mate,
+            np.arange(self.capacity))[mated]
+        reps = np.nonzero(mated)[0]
+        c["pregnant"][reps, mothers] = True
+        c["ticks_until_birth"][reps, mothers] = TICKS_UNTIL_BIRTH
+
+        # Came here to eat?
+        eating = active & self.found_food
+        cell = self.cell_type[rr, c["x"], c["y"]]
+        # A house's food is one meal: in the reference the first cat to reach
+        # it eats it, and cats acting after that no longer find it
+        house_meal = eating & (cell == HOUSE)
+        if house_meal.any():
+            keys = cell_keys[house_meal]
+            order = np.argsort(keys, kind="stable")
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order)) - \
+                np.searchsorted(keys[order], keys[order])
+            house_meal[house_meal] = rank < 1
+            self.food[np.nonzero(house_meal)[0], c["x"][house_meal],
+                c["y"][house_meal]] = False
+        caught = eating & (cell == RESTAURANT) & (self.u[U_HUNT] <
+            c["hunt_ability"] * self.mouse_prob[rr, c["x"], c["y"]])
+        if caught.any():
+            # No more catches than there are mice in the restaurant
+            keys = cell_keys[caught]
+            order = np.argsort(keys, kind="stable")
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order)) - \
+                np.searchsorted(keys[order], keys[order])
+            caught[caught] = rank < self.mice_pop.reshape(-1)[keys]
+            keys = cell_keys[caught]
+            np.subtract.at(self.mice_pop.reshape(-1), keys, 1)
+            np.add.at(self.mice_caught.reshape(-1), keys, 1)
+            np.add.at(self.mouse_growth_rate.reshape(-1), keys, 1)
+
+        success = house_meal | caught
+        c["is_hungry"] &= ~success
+        c["last_food_x"] = np.where(success, c["x"], c["last_food_x"])
+        c["last_food_y"] = np.where(success, c["y"], c["last_food_y"])
+        c["go_wander"] &= ~success
+        c["ticks_until_hungry"] = np.where(success,
+            self.p[P_HUNGRY], c["ticks_until_hungry"])
+
+    def remove_under_policy(self):
+        if not (self.cat_removal_rate and \
+            (self.current_tick % self.cat_removal_rate) == 0):
+            return
+        for r, gen in enumerate(self.gens):
+            alive = np.nonzero(self.cats["alive"][r])[0]
+            if len(alive):
+                self.cats["alive"][r, alive[gen.integers(len(alive))]] = False
+                self.num_cats_removed_under_policy[r] += 1
+
+    def add_kittens(self):
+        slot = self.current_tick % KITTEN_QUEUE_LENGTH
+        for r in np.nonzero(self.kitten_queue[:, slot])[0]:
+            self.add_cats(r, self.kitten_queue[r, slot])
+        self.kitten_queue[:, slot] = 0
+
+    # Checked on the state just collected (see CatModel.check_stopping_rules)
+    def check_stopping_rules(self):
+        num_cats = self.model_vars["Cat Pop."][-1]
+        stop = {}
+        if self.stop_on_extinction:
+            stop["extinction"] = (num_cats == 0) & \
+                ~self.kitten_queue.any(axis=1)
+        if self.max_cat_pop:
+            stop["population cap"] = num_cats >= self.max_cat_pop
+        if self.steady_state_days and \
+            len(self.model_vars["Cat Pop."]) % TICKS_PER_DAY == 0:
+            series = {stat : np.array(self.model_vars[stat])
+                for stat in STEADY_STATE_STATS}
+            stop["steady state"] = np.array([self.running[r] and
+                all([is_steady_state(series[stat][:, r].tolist(),
+                TICKS_PER_DAY, self.steady_state_days)
+                for stat in STEADY_STATE_STATS])
+                for r in range(self.num_reps)], dtype=np.bool_)
+        for reason, mask in stop.items():
+            for r in np.nonzero(mask & self.running)[0]:
+                self.running[r] = False
+                self.last_step[r] = self.steps
+                self.stop_reasons[r] = reason
+                self.cats["alive"][r] = False
+                self.compact(r)
+                self.kitten_queue[r] = 0
+
+    def step(self):
+        """Advance all replications by one step."""
+        self.collect()
+        self.check_stopping_rules()
+        self.draw()
+        self.step_environment()
+        self.update_state()
+        self.move()
+        self.act()
+        self.steps += 1
+        self.current_tick += 1
+        self.remove_under_policy()
+        self.add_kittens()
+
+    def run(self, max_steps):
+        # Same number of steps as mesa's batch_run
+        while self.steps <= max_steps and self.running.any():
+            self.step()
+
+    def get_batch_results(self, params, data_collection_period):
+        """Collected data in the same format as mesa's batch_run (one
+        dictionary per replication per collected step)."""
+        results = []
+        for r in range(self.num_reps):
+            last_step = self.steps - 1 if self.running[r] else \
+                self.last_step[r]
+            steps = list(range(0, last_step + 1, data_collection_period)) \
+                if data_collection_period > 0 else []
+            if not steps or steps[-1] != last_step:
+                steps.append(last_step)
+            results += [{"RunId" : r, "iteration" : 0, "Step" : int(step),
+                **params, "seed" : self.seeds[r], **{k : v[step][r].item()
+                for k,v in self.model_vars.items()}} for step in steps]
+        return results
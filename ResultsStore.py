@@ -0,0 +1,184 @@
+# File:         ResultsStore.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the local SQLite store for batch run
+#               results: run parameters, seeds, per-step aggregates and final
+#               statistics with confidence intervals, indexed by parameter
+#               values.
+
+import json, sqlite3, time
+
+DEFAULT_DB = "Results/results.db"
+
+# Parameter values are stored as name/value rows (rather than one column per
+# parameter) so parameters can be added to simulation_params.json without
+# changing the schema, and so any parameter can be searched through one index.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id          INTEGER PRIMARY KEY,
+    created         TEXT NOT NULL,
+    max_steps       INTEGER,
+    num_simulations INTEGER,
+    arguments       TEXT,
+    engine          TEXT NOT NULL DEFAULT 'reference'
+);
+CREATE TABLE IF NOT EXISTS run_params (
+    run_id  INTEGER NOT NULL REFERENCES runs(run_id),
+    name    TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS run_params_by_value
+    ON run_params(name, value, run_id);
+CREATE INDEX IF NOT EXISTS run_params_by_run ON run_params(run_id);
+CREATE TABLE IF NOT EXISTS simulations (
+    run_id      INTEGER NOT NULL REFERENCES runs(run_id),
+    sim_index   INTEGER NOT NULL,
+    seed        INTEGER,
+    iteration   INTEGER,
+    steps       INTEGER,
+    PRIMARY KEY (run_id, sim_index)
+);
+CREATE TABLE IF NOT EXISTS final_values (
+    run_id      INTEGER NOT NULL,
+    sim_index   INTEGER NOT NULL,
+    stat        TEXT NOT NULL,
+    value       REAL,
+    PRIMARY KEY (run_id, sim_index, stat)
+);
+CREATE TABLE IF NOT EXISTS step_stats (
+    run_id  INTEGER NOT NULL REFERENCES runs(run_id),
+    stat    TEXT NOT NULL,
+    step    INTEGER NOT NULL,
+    mean    REAL,
+    sd      REAL,
+    n       INTEGER,
+    PRIMARY KEY (run_id, stat, step)
+);
+CREATE TABLE IF NOT EXISTS final_stats (
+    run_id              INTEGER NOT NULL REFERENCES runs(run_id),
+    stat                TEXT NOT NULL,
+    mean                REAL,
+    lower               REAL,
+    upper               REAL,
+    significance_level  REAL,
+    PRIMARY KEY (run_id, stat)
+);
+"""
+
+class ResultsStore:
+    def __init__(self, path=DEFAULT_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+        # Stores created before runs recorded their engine (which was only
+        # kept in the arguments)
+        if "engine" not in [col[1] for col in
+            self.conn.execute("PRAGMA table_info(runs)")]:
+            with self.conn:
+                self.conn.execute("ALTER TABLE runs ADD COLUMN engine TEXT " +
+                    "NOT NULL DEFAULT 'reference'")
+                self.conn.execute("UPDATE runs SET engine = " +
+                    "json_extract(arguments, '$.engine') WHERE " +
+                    "json_extract(arguments, '$.engine') IS NOT NULL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS runs_by_engine " +
+            "ON runs(engine, run_id)")
+
+    def close(self):
+        self.conn.close()
+
+    # @param params Simulation parameters (one value each)
+    # @param arguments All arguments of the run, recorded as given
+    # @param simulations List of (seed, iteration, steps), one per simulation
+    # @param final_values Dictionary of stat -> list of final values (in the
+    #        same order as simulations)
+    # @param step_stats List of (stat, step, mean, sd, n)
+    # @param final_stats Dictionary of stat -> {"Mean", "Lower", "Upper"}
+    # @param engine Engine the simulations were run with
+    def add_run(self, params, arguments, max_steps, simulations, final_values,
+        step_stats, final_stats, significance_level, engine="reference"):
+        with self.conn:
+            cur = self.conn.execute("INSERT INTO runs (created, max_steps, " +
+                "num_simulations, arguments, engine) VALUES (?, ?, ?, ?, ?)",
+                (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
+                max_steps, len(simulations), json.dumps(arguments,
+                default=str), engine))
+            run_id = cur.lastrowid
+            self.conn.executemany("INSERT INTO run_params VALUES (?, ?, ?)",
+                [(run_id, k, v) for k,v in params.items()])
+            self.conn.executemany("INSERT INTO simulations VALUES " +
+                "(?, ?, ?, ?, ?)", [(run_id, i, *sim) for i, sim in
+                enumerate(simulations)])
+            self.conn.executemany("INSERT INTO final_values VALUES " +
+                "(?, ?, ?, ?)", [(run_id, i, stat, v) for stat, values in
+                final_values.items() for i, v in enumerate(values)])
+            self.conn.executemany("INSERT INTO step_stats VALUES " +
+                "(?, ?, ?, ?, ?, ?)", [(run_id, *s) for s in step_stats])
+            self.conn.executemany("INSERT INTO final_stats VALUES " +
+                "(?, ?, ?, ?, ?, ?)", [(run_id, stat, v["Mean"], v["Lower"],
+                v["Upper"], significance_level) for stat, v in
+                final_stats.items()])
+        return run_id
+
+    def find_runs(self, engine=None, **param_values):
+        """Ids of all runs with the given engine and parameter values (all
+        runs if none are given), most recent first."""
+        queries = ["SELECT run_id FROM runs" +
+            ("" if engine is None else " WHERE engine = ?")]
+        args = [] if engine is None else [engine]
+        queries += ["SELECT run_id FROM run_params WHERE name = ? AND " +
+            "value = ?"] * len(param_values)
+        for k,v in param_values.items():
+            args += [k, v]
+        query = " INTERSECT ".join(queries)
+        return sorted([r[0] for r in self.conn.execute(query, args)],
+            reverse=True)
+
+    def get_run(self, run_id):
+        """The run's details, or None if there is no such run."""
+        row = self.conn.execute("SELECT created, max_steps, " +
+            "num_simulations, arguments, engine FROM runs WHERE run_id = ?",
+            (run_id,)).fetchone()
+        if row is None:
+            return None
+        created, max_steps, num_simulations, arguments, engine = row
+        return {"run_id" : run_id, "created" : created,
+                "max_steps" : max_steps, "num_simulations" : num_simulations,
+                "arguments" : json.loads(arguments), "engine" : engine}
+
+    def get_params(self, run_id):
+        return dict(self.conn.execute("SELECT name, value FROM run_params " +
+            "WHERE run_id = ?", (run_id,)))
+
+    def get_seeds(self, run_id):
+        return [r[0] for r in self.conn.execute("SELECT seed FROM " +
+            "simulations WHERE run_id = ? ORDER BY sim_index", (run_id,))]
+
+    def get_final_stats(self, run_id):
+        return {stat : {"Mean" : mean, "Lower" : lower, "Upper" : upper}
+            for stat, mean, lower, upper in self.conn.execute("SELECT stat, " +
+            "mean, lower, upper FROM final_stats WHERE run_id = ? " +
+            "ORDER BY stat", (run_id,))}
+
+    def get_step_stats(self, run_id, stat):
+        """List of (step, mean, sd) in step order."""
+        return self.conn.execute("SELECT step, mean, sd FROM step_stats " +
+            "WHERE run_id = ? AND stat = ? ORDER BY step",
+            (run_id, stat)).fetchall()
+
+    def get_final_values(self):
+        """One dictionary per stored simulation, holding the parameters (and
+        max_steps and engine) of its run and its final values."""
+        params = {run_id : {"max_steps" : max_steps, "engine" : engine}
+            for run_id, max_steps, engine in self.conn.execute(
+            "SELECT run_id, max_steps, engine FROM runs")}
+        for run_id, name, value in self.conn.execute(
+            "SELECT run_id, name, value FROM run_params"):
+            params[run_id][name] = value
+        rows = {}
+        for run_id, sim_index, stat, value in self.conn.execute(
+            "SELECT run_id, sim_index, stat, value FROM final_values"):
+            if (run_id, sim_index) not in rows:
+                rows[(run_id, sim_index)] = dict(params[run_id])
+            rows[(run_id, sim_index)][stat] = value
+        return list(rows.values())
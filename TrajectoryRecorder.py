@@ -0,0 +1,96 @@
+# File:         TrajectoryRecorder.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the agent-level (per cat, per sampled tick)
+#               trajectory recording, written to a preallocated NumPy
+#               structured array backed by a memory-mapped file.
+
+import json, os
+import numpy as np
+
+# One row per cat per sampled tick. Unused (preallocated) rows are left
+# zeroed, and since ticks start at 1 a tick of 0 marks the end of the data.
+TRAJECTORY_DTYPE = np.dtype([
+    ("tick", np.int32),
+    ("unique_id", np.int32),
+    ("x", np.int16),
+    ("y", np.int16),
+    ("is_hungry", np.bool_),
+    ("ticks_until_hungry", np.int32),
+    ("is_asleep", np.bool_),
+    ("is_sleepy", np.bool_),
+    ("ticks_until_sleepy", np.int32),
+    ("ticks_until_awake", np.int32),
+    ("pregnant", np.bool_),
+    ("ticks_until_birth", np.int32) # -1 if not pregnant
+])
+
+# Rows preallocated up front (the file is sparse until written to, so this
+# costs no disk space); the capacity is doubled whenever it runs out.
+INITIAL_CAPACITY = 1 << 16
+
+class TrajectoryRecorder:
+    def __init__(self, path, initial_capacity=INITIAL_CAPACITY):
+        self.path = path
+        self.rows = 0
+        self.capacity = initial_capacity
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Metadata so the data file can be opened without this class
+        with open(path + ".json", "w") as f:
+            json.dump({"dtype" : TRAJECTORY_DTYPE.descr}, f)
+        self.data = np.memmap(path, dtype=TRAJECTORY_DTYPE, mode="w+",
+            shape=(self.capacity,))
+
+    def grow(self):
+        self.data.flush()
+        self.capacity *= 2
+        # Reopening in r+ mode with a larger shape extends the file in place,
+        # so nothing already written is copied
+        self.data = np.memmap(self.path, dtype=TRAJECTORY_DTYPE, mode="r+",
+            shape=(self.capacity,))
+
+    def record(self, tick, cats):
+        n = len(cats)
+        while self.rows + n > self.capacity:
+            self.grow()
+        self.data[self.rows : self.rows + n] = [
+            (tick, cat.unique_id, cat.pos[0], cat.pos[1], cat.is_hungry,
+             cat.ticks_until_hungry, cat.is_asleep, cat.is_sleepy,
+             cat.ticks_until_sleepy, cat.ticks_until_awake, cat.pregnant,
+             -1 if cat.ticks_until_birth is None else cat.ticks_until_birth)
+            for cat in cats]
+        self.rows += n
+
+    def close(self):
+        # Drop the unused preallocated rows
+        self.data.flush()
+        del self.data
+        os.truncate(self.path, self.rows * TRAJECTORY_DTYPE.itemsize)
+
+def get_num_rows(data):
+    # Binary search for the first unused (tick 0) row, so only a handful of
+    # pages need to be read even for very large files
+    lo, hi = 0, data.shape[0]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if data[mid]["tick"] == 0:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+def load_trajectories(path):
+    """Open a trajectory file read-only without loading it into memory."""
+    with open(path + ".json", "r") as f:
+        dtype = np.dtype([tuple(field) for field in json.load(f)["dtype"]])
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    data = np.memmap(path, dtype=dtype, mode="r")
+    return data[:get_num_rows(data)]
+
+def get_cat_trajectory(data, unique_id):
+    """All recorded rows for a single cat, in tick order."""
+    return data[data["unique_id"] == unique_id]
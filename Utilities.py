@@ -1,6 +1,5 @@
-import math, random
+import functools, math, os, random, secrets
 from collections import defaultdict
-import mesa
 
 # SCALE NOTES:
 # We are focusing around house lots - a street including sidewalks is
@@ -47,8 +46,103 @@ def get_locs(rng, grid_width=20, lots_between=24):
 def euclidean_distance(pos1, pos2):
     return math.sqrt(((pos1[0] - pos2[0]) ** 2) + ((pos1[1] - pos2[1]) ** 2))
 
+# NAVIGATION
+# Distances on the toroidal grid, for a cat moving one (Moore) cell per tick:
+# (number of moves needed, squared straight line distance), both wrapping
+# around the edges. Comparing these tuples prefers the fewest moves, then the
+# most direct path.
+def get_torus_distance(pos1, pos2, grid_width, grid_height):
+    dx = abs(pos1[0] - pos2[0])
+    dy = abs(pos1[1] - pos2[1])
+    dx = min(dx, grid_width - dx)
+    dy = min(dy, grid_height - dy)
+    return max(dx, dy), (dx ** 2) + (dy ** 2)
+
+# Distance to the target from every cell, indexed [x][y]. Only depends on the
+# target (the grid has no obstacles), so each is computed once and shared by
+# every cat and model.
+@functools.lru_cache(maxsize=None)
+def get_distance_field(target, grid_width, grid_height):
+    return [[get_torus_distance((x, y), target, grid_width, grid_height)
+        for y in range(grid_height)] for x in range(grid_width)]
+
+# The neighboring cell to move to, from every cell, to head towards the target
+# (the first closest one in sorted order, the order of mesa's neighborhoods),
+# indexed [x][y]. The target's own entry is None.
+@functools.lru_cache(maxsize=None)
+def get_next_step_field(target, grid_width, grid_height):
+    distances = get_distance_field(target, grid_width, grid_height)
+    field = [[None] * grid_height for _ in range(grid_width)]
+    for x in range(grid_width):
+        for y in range(grid_height):
+            if (x, y) != target:
+                field[x][y] = min(sorted({((x + dx) % grid_width,
+                    (y + dy) % grid_height) for dx in (-1, 0, 1)
+                    for dy in (-1, 0, 1) if dx or dy}),
+                    key=lambda loc : distances[loc[0]][loc[1]])
+    return field
+
+# MSER (Marginal Standard Error Rule) warm-up truncation: the number of initial
+# observations to delete so that the remaining ones have the smallest
+# (squared) marginal standard error, sum((x - mean)^2) / (n - d)^2. Every
+# truncation point is searched, but at least MSER_MIN_KEPT observations are
+# kept, as the statistic is unreliable (and tends to be smallest) for the last
+# few.
+MSER_MIN_KEPT = 5
+
+def get_mser_truncation(series, min_kept=MSER_MIN_KEPT):
+    n = len(series)
+    best_d, best_mse = 0, math.inf
+    total = total_sq = 0
+    # Suffix sums, from the end
+    for d in range(n - 1, -1, -1):
+        total += series[d]
+        total_sq += series[d] ** 2
+        kept = n - d
+        if kept < min_kept:
+            continue
+        mse = (total_sq - ((total ** 2) / kept)) / (kept ** 2)
+        if mse <= best_mse: # Ties go to the shorter truncation
+            best_d, best_mse = d, mse
+    return best_d
+
+# Mann-Kendall test: whether the series has a monotone trend (increasing or
+# decreasing) at about the 5% level (|z| > 1.96). It has little power on
+# fewer than TREND_MIN_POINTS observations.
+TREND_MIN_POINTS = 10
+
+def has_trend(series, z_critical=1.96):
+    n = len(series)
+    if n < 3:
+        return False
+    s = sum([int(series[j] > series[i]) - int(series[j] < series[i])
+        for i in range(n - 1) for j in range(i + 1, n)])
+    var = n * (n - 1) * ((2 * n) + 5) / 18
+    z = (s - 1 if s > 0 else s + 1 if s < 0 else 0) / math.sqrt(var)
+    return abs(z) > z_critical
+
+# Whether a collected series has reached steady state: MSER is applied to its
+# batch means (as in MSER-5), and the series is taken to be in steady state
+# once at least min_batches batches (and enough to test for a trend) follow
+# the truncation point, the truncation point falls in the first half of the
+# batches (past that MSER is unreliable), and the kept batches show no
+# monotone trend. Shorter series are not judged.
+def is_steady_state(series, batch_size, min_batches):
+    batch_means = [sum(series[i : i + batch_size]) / batch_size
+        for i in range(0, len(series) - batch_size + 1, batch_size)]
+    n = len(batch_means)
+    min_kept = max(min_batches, TREND_MIN_POINTS)
+    if n < 2 * min_kept:
+        return False
+    d = get_mser_truncation(batch_means)
+    return n - d >= min_kept and d <= n // 2 and \
+        not has_trend(batch_means[d:])
+
 
 def get_mesa_visualization_element(json_dict, element):
+    # Imported here so that light scripts (e.g. submit.py) which only need
+    # the argument handling below do not pay for importing mesa
+    import mesa
     mesa_type_map = {
         "Slider" : mesa.visualization.Slider,
         "Checkbox" : mesa.visualization.Checkbox
@@ -74,7 +168,9 @@ def populate_parser(parser, json_dict):
                     help=help_str)
 
 # TODO: May need to add an optional ignore list if permitting parameter sweeps
+# Returns whether any warnings were printed
 def check_args(args_dict, json_dict):
+    warned = False
     for k,v in args_dict.items():
         dict_entry = json_dict[k]
         if dict_entry["type"] == "Slider":
@@ -82,12 +178,42 @@ def check_args(args_dict, json_dict):
             max_anticipated = dict_entry["max_value"]
             step = dict_entry["step"]
             if v < min_anticipated:
+                warned = True
                 print("\x1b[41m" + k + " has a value LESS than expected" +
                     "\x1b[0m\n")
             if v > max_anticipated:
+                warned = True
                 print("\x1b[41m" + k + " has a value GREATER than expected" +
                     "\x1b[0m\n")
             if v % step != 0:
+                warned = True
                 print("\x1b[41m" + k +
                     " has a value that cannot be reached with step" +
                     "\x1b[0m\n")
+    return warned
+
+# Secret shared by worker_daemon.py and its clients. Connections carry pickled
+# objects, so anyone holding the key can run code as the daemon's user; it is
+# random per user and kept in a file only they can read.
+AUTHKEY_FILE = os.path.join(os.path.expanduser("~"), ".cat_model_authkey")
+
+# @param create Generate and store a new key if there is none yet
+def get_authkey(path=AUTHKEY_FILE, create=False):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        if not create:
+            raise
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError: # Created by another process meanwhile
+            return get_authkey(path)
+        key = secrets.token_bytes(32)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+    with os.fdopen(fd, "rb") as f:
+        if os.fstat(f.fileno()).st_mode & 0o077:
+            raise PermissionError(path + " is accessible to other users " +
+                "(chmod 600 it, or delete it to generate a new key)")
+        return f.read()
@@ -7,28 +7,86 @@
 #               batch run mode for proper estimation.
 # Run:          python3 batch_run.py
 
-import argparse, json, math, os, time
+import argparse, functools, json, math, os, time
 import mesa
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from scipy.stats import norm
 from CatModel import *
+from EnsembleModel import EnsembleModel
 from Utilities import populate_parser, check_args
+from ResultsStore import ResultsStore, DEFAULT_DB
+from results import get_pop_plot
+
+# Columns added by mesa's batch_run (the rest are parameters and reporters)
+BATCH_RUN_COLUMNS = ["RunId", "iteration", "Step"]
+# Final statistics reported with confidence intervals
+CONF_STATS = ["Cats Pregnant", "Cat Fights", "Cats Hit", "Cat Pop.",
+    "Mice Pop."]
+
+# Simulations may be stopped early by the stopping rules (see CatModel.py), so
+# each one is carried forward at its final values past the step it stopped
+# at, keeping every step's statistics over all of the simulations. Steps that
+# only some simulations collected (e.g. the step one stopped at) are left out.
+def get_step_stats(res_df, break_col, stats):
+    last_steps = res_df.groupby(break_col)["Step"].max()
+    step_stats = []
+    for stat in stats:
+        table = res_df.pivot(index="Step", columns=break_col, values=stat)
+        stopped = np.greater.outer(table.index.values,
+            last_steps[table.columns].values)
+        table = table.where(~stopped, table.ffill()).dropna()
+        mean, sd, n = table.mean(axis=1), table.std(axis=1), \
+            table.count(axis=1)
+        step_stats += [(stat, int(step), mean[step], sd[step], int(n[step]))
+            for step in table.index]
+    return step_stats
+
+def get_conf_intervals(last_values, stats, significance_level):
+    conf_dict = {}
+    # Number of simulations (n) must be length of last_values
+    n = last_values.shape[0]
+    # Get factor from the normal distribution
+    z = norm.ppf(1 - (significance_level / 2))
 
-def get_pop_plot(res_df, population, datetime):
-    mean_pop = res_df.groupby(["Step"]).mean()[population + " Pop."]
-    sd_pop = res_df.groupby(["Step"]).std()[population + " Pop."]
-
-    fig, ax = plt.subplots()
-    x_axis = (mean_pop.index.to_numpy() / 96)
-    ax.fill_between(x_axis, mean_pop - sd_pop,
-        mean_pop + sd_pop, alpha=.5, linewidth=0)
-    ax.plot(x_axis, mean_pop, linewidth=2)
-    ax.set_xlabel("Days")
-    ax.set_ylabel(population + " population")
-    ax.set_title(population + " population growth")
-    fig.savefig("Results/" + datetime + population + "_pop_growth.png")
-    plt.close()
+    for stat in stats:
+        curr_col = last_values[stat]
+        mean_stat = curr_col.mean()
+        var_stat = curr_col.var()
+        half_interval = z * math.sqrt(var_stat / n)
+        conf_dict[stat] = { "Mean" : mean_stat,
+                            "Upper" : round(mean_stat + half_interval, 2),
+                            "Lower" : round(mean_stat - half_interval, 2)}
+    return conf_dict
+
+# Aggregate the results of a batch run and record them in the results store
+# @param break_col Column identifying each simulation
+# @param params The (single valued) simulation parameters of the run
+# @param arguments All arguments of the run, recorded as given
+# @param engine Engine the simulations were run with
+def save_results(res_df, break_col, params, arguments, max_steps,
+    significance_level, db_path=DEFAULT_DB, engine="reference"):
+    reporters = [c for c in res_df.columns
+        if c not in BATCH_RUN_COLUMNS and c not in params and c != "seed"]
+    # Get last value in each simulation
+    last_values = res_df.groupby([break_col]).tail(1)
+    conf_dict = get_conf_intervals(last_values, CONF_STATS,
+        significance_level)
+
+    seeds = last_values["seed"] if "seed" in last_values else \
+        [None] * last_values.shape[0]
+    simulations = [(None if seed is None else int(seed), int(iteration),
+        int(step)) for seed, iteration, step in zip(seeds,
+        last_values["iteration"], last_values["Step"])]
+
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    store = ResultsStore(db_path)
+    run_id = store.add_run(params, arguments, max_steps, simulations,
+        {stat : last_values[stat].tolist() for stat in reporters},
+        get_step_stats(res_df, break_col, reporters), conf_dict,
+        significance_level, engine)
+    store.close()
+    return run_id, last_values.shape[0], conf_dict
 
 if __name__ == "__main__":
     # Read in JSON file with simulation parameters
@@ -55,71 +113,63 @@ if __name__ == "__main__":
         help="Seed for reproducibility")
     parser.add_argument("--significance_level", type=float, default=0.05,
         help="Significance level for confidence interval estimation")
+    parser.add_argument("--engine", choices=["reference", "ensemble"],
+        default="reference", help="Run each simulation as its own CatModel " +
+        "(reference), or all of them together in one EnsembleModel")
+    parser.add_argument("--results_db", default=DEFAULT_DB,
+        help="SQLite database in which to store the results")
     args = parser.parse_args()
     args_sim_params = {k : v for k,v in vars(args).items() if k in sim_params}
 
-    file_datetime = time.strftime("%Y_%m_%d_%H_%M_",time.localtime())
-
     # Verify all simulation arguments against the min, max and step specified
     # in the JSON file
-    check_args(args_sim_params, sim_params)
-    time.sleep(3) # Sleep so warnings can be clearly observed
+    if check_args(args_sim_params, sim_params):
+        time.sleep(3) # Sleep so warnings can be clearly observed
 
     if args.repro_iter:
         args_sim_params["seed"] = range(args.seed, args.seed + args.repro_iter)
 
     # Run
-    results = mesa.batch_run(
-        CatModel,
-        parameters=args_sim_params,
-        number_processes=args.number_processes,
-        iterations=args.iterations,
-        data_collection_period=args.data_collection_period,
-        max_steps=args.max_steps,
-        display_progress=args.no_display_progress
-    )
+    if args.engine == "ensemble":
+        # All simulations advance together in a single process
+        params = {k : v for k,v in args_sim_params.items() if k != "seed"}
+        seeds = list(args_sim_params.get("seed", [None]))
+        model = EnsembleModel(**params,
+            seeds=[seed for _ in range(args.iterations) for seed in seeds])
+        model.run(args.max_steps)
+        results = model.get_batch_results(params, args.data_collection_period)
+        for row in results:
+            row["iteration"] = row["RunId"] // len(seeds)
+    else:
+        results = mesa.batch_run(
+            # Knowing the run length lets trajectory files be sized up front
+            functools.partial(CatModel, max_steps=args.max_steps),
+            parameters=args_sim_params,
+            number_processes=args.number_processes,
+            iterations=args.iterations,
+            data_collection_period=args.data_collection_period,
+            max_steps=args.max_steps,
+            display_progress=args.no_display_progress
+        )
 
     res_df = pd.DataFrame(results)
 
-    # Create a Results directory
-    os.makedirs("Results/", exist_ok=True)
-
-    # Plot populations over time
-    get_pop_plot(res_df, "Cat", file_datetime)
-    get_pop_plot(res_df, "Mice", file_datetime)
-
-    # Get simulation-length averages with confidence intervals
-    # Set up a dictionary to hold the results
-    conf_dict = {}
-    # Get last value in each simulation
+    # Record the results in the results store
     break_col =  "RunId" if args.repro_iter else "iteration"
-    last_values = res_df.groupby([break_col]).tail(1)
-    # Number of simulations (n) must be length of last_values
-    n = last_values.shape[0]
-    # Get factor from the normal distribution
-    z = norm.ppf(1 - (args.significance_level / 2))
-
-    for stat in ["Cats Pregnant", "Cat Fights", "Cats Hit"]:
-        curr_col = last_values[stat]
-        mean_stat = curr_col.mean()
-        var_stat = curr_col.var()
-        half_interval = z * math.sqrt(var_stat / n)
-        conf_dict[stat] = { "Mean" : mean_stat,
-                            "Upper" : round(mean_stat + half_interval, 2),
-                            "Lower" : round(mean_stat - half_interval, 2)}
-
-    with open("Results/" + file_datetime + "output.txt", "w") as f:
-        # First record the arguments for the run
-        f.write("ARGUMENTS:\n")
-        for k,v in vars(args).items():
-            f.write(k + " = " + str(v) + "\n")
-
-        f.write("\n\nSTATS:\n")
-        # Next report all stats and confidence intervals
-        f.write("Number of simulations conducted: " + str(n) + "\n")
-        f.write("Max steps per simulation: " + str(args.max_steps) + "\n\n")
-        for k,v in conf_dict.items():
-            f.write(k + " Mean: " + str(v["Mean"]) + " (" + str(v["Lower"]) + \
-                "," + str(v["Upper"]) + ")\n\n")
-
+    run_id, n, conf_dict = save_results(res_df, break_col,
+        {k : v for k,v in args_sim_params.items() if k != "seed"}, vars(args),
+        args.max_steps, args.significance_level, args.results_db, args.engine)
 
+    # Plot populations over time
+    get_pop_plot(args.results_db, run_id, "Cat")
+    get_pop_plot(args.results_db, run_id, "Mice")
+
+    # Report all stats and confidence intervals
+    print("Results stored as run " + str(run_id) + " in " + args.results_db)
+    print("Number of simulations conducted: " + str(n))
+    print("Max steps per simulation: " + str(args.max_steps))
+    print("Simulations stopped early: " + str(int((res_df.groupby(
+        [break_col])["Step"].max() < args.max_steps).sum())) + "\n")
+    for k,v in conf_dict.items():
+        print(k + " Mean: " + str(v["Mean"]) + " (" + str(v["Lower"]) + \
+            "," + str(v["Upper"]) + ")")
@@ -0,0 +1,169 @@
+# File:         equivalence.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the reference-equivalence harness for
+#               alternative (e.g. optimized) engines. It runs the reference
+#               CatModel and a candidate engine on the same seeds and checks
+#               either that they pass through exactly the same states, tick by
+#               tick (for engines meant to be identical), or that their final
+#               values have the same distributions (for engines only meant to
+#               be statistically equivalent, such as EnsembleModel). Exits
+#               with a nonzero status if the check fails.
+# Run:          python3 equivalence.py exact --candidate CatModel:CatModel
+#               python3 equivalence.py stats --candidate ensemble
+
+import argparse, hashlib, importlib, json, sys
+import numpy as np
+from scipy import stats
+from CatModel import CatAgent, HouseAgent
+from Utilities import populate_parser
+
+# Shorthands for the engines in this repository; any other engine is given as
+# module:Class
+ENGINES = {
+    "reference" : "CatModel:CatModel",
+    "ensemble" : "EnsembleModel:EnsembleModel"
+}
+# Final values compared in stats mode
+DEFAULT_STATS = ["Cat Pop.", "Mice Pop.", "Cat Fights"]
+
+def load_engine(spec):
+    module, cls = ENGINES.get(spec, spec).split(":")
+    return getattr(importlib.import_module(module), cls)
+
+# Full state of a CatModel-like model, split into parts so that a mismatch can
+# be narrowed down. Cats are ordered by id, so the schedule's (random) order
+# does not matter - only its effects.
+def get_state(model):
+    agents = model.schedule.agents
+    return {
+        "cats" : sorted([(cat.unique_id, cat.pos, cat.sex,
+            cat.aggressiveness, cat.hunt_ability, cat.hunger_rate,
+            cat.is_hungry, cat.ticks_until_hungry, cat.last_food_loc,
+            cat.go_wander, cat.sleepy_rate, cat.is_asleep, cat.is_sleepy,
+            cat.ticks_until_sleepy, cat.ticks_until_awake, cat.pregnant,
+            cat.ticks_until_birth) for cat in model.cat_list]),
+        "restaurants" : [(res.pos, res.mice_pop, res.mouse_growth_rate,
+            res.ticks_until_new_mouse, res.mice_caught)
+            for res in model.restaurant_list],
+        "houses" : sorted([(house.pos, house.food) for house in agents
+            if isinstance(house, HouseAgent)]),
+        "kittens" : sorted(model.kitten_queue.items()),
+        "counters" : (model.current_tick, model.num_cats, model.cat_fights,
+            model.num_cats_hit_by_car, model.num_cats_removed_under_policy,
+            len([a for a in agents if isinstance(a, CatAgent)]))
+    }
+
+def get_state_digest(model):
+    return {k : hashlib.sha256(repr(v).encode()).hexdigest()
+        for k,v in get_state(model).items()}
+
+# Digest of the state before the first step and after every step
+def get_digests(engine_cls, params, seed, max_steps):
+    model = engine_cls(**params, seed=seed)
+    digests = [get_state_digest(model)]
+    while model.running and model.schedule.steps <= max_steps:
+        model.step()
+        digests.append(get_state_digest(model))
+    return digests
+
+# Returns None if identical, else (step, differing state parts)
+def compare_digests(reference, candidate):
+    for step, (ref, cand) in enumerate(zip(reference, candidate)):
+        if ref != cand:
+            return step, [k for k in ref if ref[k] != cand.get(k)]
+    if len(reference) != len(candidate):
+        return min(len(reference), len(candidate)), ["length"]
+    return None
+
+# @return Dictionary of stat -> array of final values, one per seed
+def get_final_values(engine_cls, params, seeds, max_steps, stat_names):
+    if hasattr(engine_cls, "get_batch_results"): # Batched engine
+        model = engine_cls(**params, seeds=seeds)
+        model.run(max_steps)
+        rows = model.get_batch_results(params, -1)
+    else:
+        rows = []
+        for seed in seeds:
+            model = engine_cls(**params, seed=seed)
+            while model.running and model.schedule.steps <= max_steps:
+                model.step()
+            rows.append({k : v[-1] for k,v in
+                model.datacollector.model_vars.items()})
+    return {stat : np.array([row[stat] for row in rows], dtype=float)
+        for stat in stat_names}
+
+if __name__ == "__main__":
+    # Read in JSON file with simulation parameters
+    with open("simulation_params.json", "r") as f:
+        sim_params = json.load(f)
+
+    common = argparse.ArgumentParser(add_help=False)
+    # Pull simulation arguments from JSON file
+    populate_parser(common, sim_params)
+    common.add_argument("--candidate", default="reference",
+        help="Engine to check: " + ", ".join(ENGINES) + " or module:Class")
+    common.add_argument("--max_steps", type=int, default=1000,
+        help="How many steps to run each simulation")
+    common.add_argument("--seed", type=int, default=1234,
+        help="First seed")
+
+    parser = argparse.ArgumentParser(
+        description="Check an alternative Cat ABM engine against CatModel")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    exact_parser = subparsers.add_parser("exact", parents=[common],
+        help="Require identical states at every tick")
+    exact_parser.add_argument("--repro_iter", type=int, default=3,
+        help="Number of seeds to check")
+    stats_parser = subparsers.add_parser("stats", parents=[common],
+        help="Require the same distribution of final values")
+    stats_parser.add_argument("--repro_iter", type=int, default=30,
+        help="Number of seeds (simulations per engine)")
+    stats_parser.add_argument("--stats", nargs="+", default=DEFAULT_STATS,
+        help="Final values to compare")
+    stats_parser.add_argument("--significance_level", type=float,
+        default=0.05, help="Family-wise significance level (Bonferroni " +
+        "corrected across the compared stats)")
+    args = parser.parse_args()
+    args_sim_params = {k : v for k,v in vars(args).items() if k in sim_params}
+
+    reference = load_engine("reference")
+    candidate = load_engine(args.candidate)
+    seeds = list(range(args.seed, args.seed + args.repro_iter))
+
+    failed = False
+    if args.mode == "exact":
+        if hasattr(candidate, "get_batch_results"): # Batched engine
+            sys.exit("exact mode requires a per-seed engine; " +
+                args.candidate + " runs batches of seeds (use stats mode)")
+        # Each model is run on its own, as CatModel seeds NumPy's global
+        # generator
+        for seed in seeds:
+            mismatch = compare_digests(
+                get_digests(reference, args_sim_params, seed, args.max_steps),
+                get_digests(candidate, args_sim_params, seed, args.max_steps))
+            if mismatch is None:
+                print("seed " + str(seed) + ": identical")
+            else:
+                failed = True
+                print("seed " + str(seed) + ": differs at step " +
+                    str(mismatch[0]) + " (" + ", ".join(mismatch[1]) + ")")
+    else:
+        ref_values = get_final_values(reference, args_sim_params, seeds,
+            args.max_steps, args.stats)
+        cand_values = get_final_values(candidate, args_sim_params, seeds,
+            args.max_steps, args.stats)
+        alpha = args.significance_level / len(args.stats)
+        for stat in args.stats:
+            p_value = stats.ks_2samp(ref_values[stat], cand_values[stat]).pvalue
+            failed = failed or p_value < alpha
+            print(stat + ": reference mean " +
+                str(round(ref_values[stat].mean(), 2)) + ", candidate mean " +
+                str(round(cand_values[stat].mean(), 2)) + ", KS p-value " +
+                str(round(p_value, 4)) +
+                (" (DIFFERENT)" if p_value < alpha else ""))
+
+    print("\nFAIL" if failed else "\nPASS")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,68 @@
+// Line chart for server.py's BatchedChartModule: like Mesa's ChartModule,
+// except that each render receives the steps collected since the last one
+// (as the model runs ahead of the browser), rather than a single value. Only
+// steps that are multiples of data.period are sent; when the period grows,
+// the points no longer on it are dropped.
+const BatchedChartModule = function (series, canvas_width, canvas_height) {
+  const canvas = document.createElement("canvas");
+  Object.assign(canvas, {
+    width: canvas_width,
+    height: canvas_height,
+    style: "border:1px dotted",
+  });
+  // Append it to #elements
+  const elements = document.getElementById("elements");
+  elements.appendChild(canvas);
+  const context = canvas.getContext("2d");
+
+  const datasets = series.map((s) => ({
+    label: s.Label,
+    borderColor: s.Color,
+    data: [],
+    pointRadius: 0,
+  }));
+
+  const chart = new Chart(context, {
+    type: "line",
+    data: { labels: [], datasets: datasets },
+    options: {
+      responsive: true,
+      // Batches may hold many points, so skip the per-update animation
+      animation: false,
+      scales: {
+        x: { display: true, ticks: { maxTicksLimit: 11 } },
+        y: { display: true },
+      },
+    },
+  });
+
+  let period = 1;
+
+  this.render = (data) => {
+    if (data.steps.length === 0 && data.period === period) {
+      return;
+    }
+    if (data.period !== period) {
+      period = data.period;
+      const keep = chart.data.labels.map((step) => step % period === 0);
+      chart.data.labels = chart.data.labels.filter((_, j) => keep[j]);
+      chart.data.datasets.forEach((dataset) => {
+        dataset.data = dataset.data.filter((_, j) => keep[j]);
+      });
+    }
+    chart.data.labels.push(...data.steps);
+    for (let i = 0; i < data.series.length; i++) {
+      chart.data.datasets[i].data.push(...data.series[i]);
+    }
+    chart.update();
+  };
+
+  this.reset = () => {
+    period = 1;
+    chart.data.labels = [];
+    chart.data.datasets.forEach((dataset) => {
+      dataset.data = [];
+    });
+    chart.update();
+  };
+};
@@ -0,0 +1,126 @@
+# File:         results.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the commands for querying, comparing and
+#               plotting the batch run results kept in the results store,
+#               without re-running any simulations.
+# Run:          python3 results.py list --cat_removal_rate 360
+#               python3 results.py show 3
+#               python3 results.py compare 3 4
+#               python3 results.py plot 3
+
+import argparse, json, os, sys
+import matplotlib.pyplot as plt
+import numpy as np
+from ResultsStore import ResultsStore, DEFAULT_DB
+
+def get_pop_plot(db_path, run_id, population):
+    store = ResultsStore(db_path)
+    steps, mean_pop, sd_pop = (np.array(col, dtype=float) for col in
+        zip(*store.get_step_stats(run_id, population + " Pop.")))
+    store.close()
+    sd_pop = np.nan_to_num(sd_pop) # Undefined for a single simulation
+
+    fig, ax = plt.subplots()
+    x_axis = steps / 96
+    ax.fill_between(x_axis, mean_pop - sd_pop,
+        mean_pop + sd_pop, alpha=.5, linewidth=0)
+    ax.plot(x_axis, mean_pop, linewidth=2)
+    ax.set_xlabel("Days")
+    ax.set_ylabel(population + " population")
+    ax.set_title(population + " population growth")
+    fig.savefig("Results/run_" + str(run_id) + "_" + population +
+        "_pop_growth.png")
+    plt.close()
+
+def print_run(store, run_id):
+    run = store.get_run(run_id)
+    print("RUN " + str(run_id) + " (" + run["created"] + ", " +
+        run["engine"] + " engine)")
+    print("PARAMETERS:")
+    for k,v in store.get_params(run_id).items():
+        print(k + " = " + str(v))
+    print("Seeds: " + str(store.get_seeds(run_id)))
+    print("\nSTATS:")
+    print("Number of simulations conducted: " + str(run["num_simulations"]))
+    print("Max steps per simulation: " + str(run["max_steps"]) + "\n")
+    for k,v in store.get_final_stats(run_id).items():
+        print(k + " Mean: " + str(v["Mean"]) + " (" + str(v["Lower"]) + \
+            "," + str(v["Upper"]) + ")")
+
+if __name__ == "__main__":
+    # Read in JSON file with simulation parameters
+    with open("simulation_params.json", "r") as f:
+        sim_params = json.load(f)
+
+    parser = argparse.ArgumentParser(
+        description="Query the stored Cat ABM batch run results")
+    parser.add_argument("--results_db", default=DEFAULT_DB,
+        help="SQLite database holding the results")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list",
+        help="List runs, optionally only those with given parameter values")
+    # No defaults here: only the parameters given are used to filter
+    list_parser.add_argument("--engine", choices=["reference", "ensemble"],
+        help="Engine the simulations were run with")
+    for k,v in sim_params.items():
+        if v["type"] == "Slider":
+            list_parser.add_argument("--" + k, type=type(v["value"]),
+                help=v["name"])
+
+    show_parser = subparsers.add_parser("show", help="Show a single run")
+    show_parser.add_argument("run_id", type=int)
+
+    compare_parser = subparsers.add_parser("compare",
+        help="Compare the final statistics of several runs")
+    compare_parser.add_argument("run_ids", type=int, nargs="+")
+
+    plot_parser = subparsers.add_parser("plot",
+        help="Plot the population growth of a run")
+    plot_parser.add_argument("run_id", type=int)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.results_db):
+        sys.exit("No results store at " + args.results_db +
+            " (batch runs create it)")
+    store = ResultsStore(args.results_db)
+    run_ids = args.run_ids if args.command == "compare" else \
+        [args.run_id] if args.command in ["show", "plot"] else []
+    for run_id in run_ids:
+        if store.get_run(run_id) is None:
+            store.close()
+            sys.exit("No run " + str(run_id) + " in " + args.results_db)
+
+    if args.command == "list":
+        filters = {k : getattr(args, k) for k in sim_params
+            if getattr(args, k, None) is not None}
+        for run_id in store.find_runs(args.engine, **filters):
+            run = store.get_run(run_id)
+            params = store.get_params(run_id)
+            print(str(run_id) + "\t" + run["created"] + "\t" + run["engine"] +
+                "\t" + ", ".join([k + "=" + str(v) for k,v in params.items()]))
+    elif args.command == "show":
+        print_run(store, args.run_id)
+    elif args.command == "compare":
+        all_params = {run_id : dict(store.get_params(run_id),
+            engine=store.get_run(run_id)["engine"]) for run_id in args.run_ids}
+        all_stats = {run_id : store.get_final_stats(run_id)
+            for run_id in args.run_ids}
+        print("\t".join(["run"] + [str(r) for r in args.run_ids]))
+        # Only show the parameters (and engines) that differ
+        for k in ["engine"] + list(sim_params):
+            values = [all_params[r].get(k) for r in args.run_ids]
+            if len(set(values)) > 1:
+                print("\t".join([k] + [str(v) for v in values]))
+        for stat in all_stats[args.run_ids[0]]:
+            print("\t".join([stat] + [str(round(all_stats[r][stat]["Mean"],
+                2)) + " (" + str(all_stats[r][stat]["Lower"]) + "," +
+                str(all_stats[r][stat]["Upper"]) + ")"
+                for r in args.run_ids if stat in all_stats[r]]))
+    elif args.command == "plot":
+        get_pop_plot(args.results_db, args.run_id, "Cat")
+        get_pop_plot(args.results_db, args.run_id, "Mice")
+    store.close()
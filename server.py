@@ -4,10 +4,16 @@
 # Professor:    Professor Vazquez-Abad
 # Assignment:   Final Project
 # Description:  This file contains the code necessary to run the simulation in
-#               interactive and visual fashion in the browser.
+#               interactive and visual fashion in the browser. The model runs
+#               ahead in a background thread at full speed, and the browser
+#               is sent snapshots of it at its own (render) rate.
 # Run:          python3 server.py
 
-import argparse, json
+import argparse, asyncio, json, queue, threading, time
+from concurrent.futures import Future
+import tornado.escape
+from mesa.visualization.ModularVisualization import SocketHandler, \
+    CHART_JS_FILE
 from CatModel import *
 from Utilities import get_mesa_visualization_element
 
@@ -82,6 +88,165 @@ def agent_portrayal(agent):
     return portrayal
 
 
+# Runs the server's model in its own thread. All access to the model (steps,
+# renders, resets) happens on this thread, in the order it is requested, so
+# no locking is needed.
+class BackgroundModelRunner(threading.Thread):
+    def __init__(self, server):
+        super().__init__(daemon=True)
+        self.server = server
+        self.commands = queue.Queue()
+        self.playing = False
+        self.steps = 0
+        self.steps_per_second = 0
+        self.last_render = (time.monotonic(), 0)
+
+    # Returns a Future holding the command's result
+    def submit(self, command):
+        future = Future()
+        self.commands.put((command, future))
+        return future
+
+    def run(self):
+        while True:
+            # Step freely while playing, serving requests between steps
+            if self.playing and self.commands.empty():
+                self.step_model()
+                continue
+            command, future = self.commands.get()
+            try:
+                future.set_result(getattr(self, command)())
+            except Exception as e:
+                future.set_exception(e)
+
+    def step_model(self):
+        if self.server.model.running:
+            self.server.model.step()
+            self.steps += 1
+        else:
+            self.playing = False
+
+    # COMMANDS
+    def play(self):
+        self.playing = True
+
+    def pause(self):
+        self.playing = False
+
+    def render(self):
+        now = time.monotonic()
+        last_time, last_steps = self.last_render
+        self.steps_per_second = (self.steps - last_steps) / \
+            max(now - last_time, 1e-6)
+        self.last_render = (now, self.steps)
+        return self.server.render_model(), self.server.model.running
+
+    def step(self):
+        # A single step (e.g. the Step button while paused)
+        self.step_model()
+        return self.render()
+
+    def reset(self):
+        # The page keeps its running state across a reset, so playing does
+        # too (only pause, or the model stopping, clears it)
+        self.server.model.close_trajectory_recorder()
+        self.server.reset_model()
+        return self.render()
+
+class BackgroundSocketHandler(SocketHandler):
+    async def on_message(self, message):
+        msg = tornado.escape.json_decode(message)
+        runner = self.application.runner
+
+        if msg["type"] in ["get_step", "reset"]:
+            # While playing the model is already stepping, so a step request
+            # just asks for the latest snapshot
+            command = "reset" if msg["type"] == "reset" else \
+                "render" if runner.playing else "step"
+            data, running = await asyncio.wrap_future(runner.submit(command))
+            if msg["type"] == "get_step" and not running:
+                self.write_message({"type" : "end"})
+            else:
+                self.write_message({"type" : "viz_state", "data" : data})
+        elif msg["type"] in ["play", "pause"]:
+            runner.submit(msg["type"])
+        else:
+            super().on_message(message)
+
+# Like mesa's ChartModule, but each render sends the steps collected since the
+# previous render, as the model runs ahead of the browser. Only steps that are
+# multiples of a period are charted; the period doubles whenever the chart
+# would otherwise hold more than max_points (the browser then drops the points
+# no longer on it), so long runs stay cheap to send and draw
+class BatchedChartModule(mesa.visualization.ChartModule):
+    package_includes = [CHART_JS_FILE]
+    local_includes = ["BatchedChartModule.js"]
+    local_dir = "js"
+
+    def __init__(self, series, canvas_height=200, canvas_width=500,
+        data_collector_name="datacollector", max_points=1000):
+        super().__init__(series, canvas_height, canvas_width,
+            data_collector_name)
+        self.js_code = self.js_code.replace("new ChartModule",
+            "new BatchedChartModule")
+        self.max_points = max_points
+        self.model = None
+        self.next_step = 0
+        self.period = 1
+
+    def render(self, model):
+        if model is not self.model: # New (e.g. reset) model
+            self.model = model
+            self.next_step = 0
+            self.period = 1
+        model_vars = getattr(model, self.data_collector_name).model_vars
+        num_collected = len(model_vars[self.series[0]["Label"]])
+        while -(-num_collected // self.period) > self.max_points:
+            self.period *= 2
+            self.next_step = -(-self.next_step // self.period) * self.period
+        steps = list(range(self.next_step, num_collected, self.period))
+        if steps:
+            self.next_step = steps[-1] + self.period
+        return {"period" : self.period, "steps" : steps, "series" : [
+            [model_vars[s["Label"]][step] for step in steps]
+            for s in self.series]}
+
+# Shows the model's own progress, and hooks the page's start/stop controls up
+# to the background runner
+class BackgroundControlElement(mesa.visualization.TextElement):
+    def __init__(self, runner, render_rate):
+        super().__init__()
+        self.runner = runner
+        self.js_code += """
+            const startModel = controller.start.bind(controller);
+            const stopModel = controller.stop.bind(controller);
+            controller.start = () => { send({type: "play"}); startModel(); };
+            controller.stop = () => { send({type: "pause"}); stopModel(); };
+            controller.updateFPS(%d);
+            fpsControl.setValue(%d);
+        """ % (render_rate, render_rate)
+
+    def render(self, model):
+        return "Tick: " + str(model.current_tick) + " (day " + \
+            str(round((model.current_tick * MINUTES_PER_TICK) / (24 * 60),
+            1)) + "), " + str(round(self.runner.steps_per_second)) + \
+            " ticks per second"
+
+class BackgroundModularServer(mesa.visualization.ModularServer):
+    def __init__(self, model_cls, visualization_elements, name, model_params,
+        render_rate):
+        self.runner = BackgroundModelRunner(self)
+        super().__init__(model_cls, list(visualization_elements) +
+            [BackgroundControlElement(self.runner, render_rate)], name,
+            model_params)
+        # Rebuild the application's routes with the websocket served by the
+        # background aware handler
+        self.handlers = [(r"/ws", BackgroundSocketHandler) \
+            if handler[0] == r"/ws" else handler for handler in self.handlers]
+        tornado.web.Application.__init__(self, self.handlers, **self.settings)
+        self.runner.start()
+
+
 if __name__ == "__main__":
     # Read in JSON file with simulation parameters
     with open("simulation_params.json", "r") as f:
@@ -102,6 +267,9 @@ if __name__ == "__main__":
         help="Width of the grid display in pixels")
     parser.add_argument("--grid_px_height", type=int, default=1000,
         help="Height of the grid display in pixels")
+    parser.add_argument("--render_rate", type=int, default=5,
+        help="Snapshots per second sent to the browser (0-20, also " +
+        "adjustable in the page); the model itself runs at full speed")
     args = parser.parse_args()
 
     model_parameters = {
@@ -111,32 +279,32 @@ if __name__ == "__main__":
         GRID_HEIGHT, args.grid_px_width, args.grid_px_height)
     charts=[]
     if args.all_charts or args.hunger_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Hunger", "Color" : "Black"}]))
     if args.all_charts or args.mice_pop_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Mice Pop.", "Color" : "Black"}]))
     if args.all_charts or args.max_hunger_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Max Hunger", "Color" : "Black"}]))
     if args.all_charts or args.cat_pop_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Cat Pop.", "Color" : "Black"}]))
     if args.all_charts or args.cat_pregnancies_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Cats Pregnant", "Color" : "Black"}]))
     if args.all_charts or args.cats_hit_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Cats Hit", "Color" : "Black"}]))
     if args.all_charts or args.cats_removed_under_policy_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Cats Removed", "Color" : "Black"}]))
     if args.all_charts or args.cat_fights_chart:
-        charts.append(mesa.visualization.ChartModule(
+        charts.append(BatchedChartModule(
             [{"Label" : "Cat Fights", "Color" : "Black"}]))
 
     elements = [grid] + charts
-    server = mesa.visualization.ModularServer(
-        CatModel, elements, "Cat Model", model_parameters)
+    server = BackgroundModularServer(
+        CatModel, elements, "Cat Model", model_parameters, args.render_rate)
     server.launch()
 
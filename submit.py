@@ -0,0 +1,99 @@
+# File:         submit.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the thin client for worker_daemon.py: it
+#               submits a simulation job to the running service and prints
+#               the results as they are streamed back. It deliberately
+#               imports nothing heavy so that it starts instantly.
+# Run:          python3 submit.py --repro_iter 4 --max_steps 500
+
+import argparse, json, sys
+from multiprocessing.connection import Client
+from Utilities import populate_parser, check_args, get_authkey, AUTHKEY_FILE
+
+# Must match worker_daemon.py
+DEFAULT_ADDRESS = ("localhost", 6174)
+# Final values printed for each completed simulation
+PRINT_STATS = ["Cat Pop.", "Mice Pop.", "Cat Fights", "Cats Hit"]
+
+if __name__ == "__main__":
+    # Read in JSON file with simulation parameters
+    with open("simulation_params.json", "r") as f:
+        sim_params = json.load(f)
+
+    parser = argparse.ArgumentParser(
+        description="Submit a Cat ABM simulation job to worker_daemon.py")
+    # Pull simulation arguments from JSON file
+    populate_parser(parser, sim_params)
+    # Same batch running arguments as batch_run.py
+    parser.add_argument("--iterations", type=int, default=1,
+        help="Number of times to run for each combination of parameters")
+    parser.add_argument("--data_collection_period", type=int, default=96,
+        help="How many steps in between collection (-1 = only at end)")
+    parser.add_argument("--max_steps", type=int, default=1000,
+        help="How many steps to run the simulation")
+    parser.add_argument("--repro_iter", type=int, default=10,
+        help="Use this to set how many unique seeds to use")
+    parser.add_argument("--seed", type=int, default=1234,
+        help="Seed for reproducibility")
+    parser.add_argument("--significance_level", type=float, default=0.05,
+        help="Significance level for confidence interval estimation")
+    parser.add_argument("--store", action="store_true",
+        help="Record the results in the results store")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0],
+        help="Address of the worker service")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1],
+        help="Port of the worker service")
+    args = parser.parse_args()
+    args_sim_params = {k : v for k,v in vars(args).items() if k in sim_params}
+
+    # Warn, but do not wait, about unexpected arguments
+    check_args(args_sim_params, sim_params)
+
+    seeds = list(range(args.seed, args.seed + args.repro_iter)) \
+        if args.repro_iter else [None]
+    job = {"params" : args_sim_params,
+           "seeds" : [(i, seed) for i in range(args.iterations)
+                for seed in seeds],
+           "max_steps" : args.max_steps,
+           "data_collection_period" : args.data_collection_period,
+           "significance_level" : args.significance_level,
+           "store" : args.store}
+
+    try:
+        authkey = get_authkey(AUTHKEY_FILE)
+    except FileNotFoundError:
+        sys.exit("No key in " + AUTHKEY_FILE + " (start the worker service " +
+            "with python3 worker_daemon.py, which creates it)")
+    except PermissionError as e:
+        sys.exit(str(e))
+    try:
+        conn = Client((args.host, args.port), authkey=authkey)
+    except ConnectionRefusedError:
+        sys.exit("No worker service running at " + args.host + ":" +
+            str(args.port) + " (start it with python3 worker_daemon.py)")
+
+    with conn:
+        conn.send(job)
+        completed = 0
+        while True:
+            msg = conn.recv()
+            if msg["type"] == "result":
+                completed += 1
+                final = msg["final"]
+                print("[" + str(completed) + "/" + str(len(job["seeds"])) +
+                    "] seed " + str(final["seed"]) + ", step " +
+                    str(final["Step"]) + ": " + ", ".join([stat + " = " +
+                    str(final[stat]) for stat in PRINT_STATS]))
+            elif msg["type"] == "done":
+                if msg["run_id"] is not None:
+                    print("\nResults stored as run " + str(msg["run_id"]))
+                print()
+                for k,v in msg["stats"].items():
+                    print(k + " Mean: " + str(v["Mean"]) + " (" +
+                        str(v["Lower"]) + "," + str(v["Upper"]) + ")")
+                break
+            elif msg["type"] == "error":
+                sys.exit(msg["message"])
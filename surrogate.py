@@ -0,0 +1,349 @@
+# File:         surrogate.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains a Gaussian process surrogate (emulator) of
+#               the simulation, fit to the stored batch run results, so that
+#               "what if" questions can be answered without simulating and so
+#               that the next parameter points to simulate can be suggested.
+# Run:          python3 surrogate.py fit
+#               python3 surrogate.py query --cat_removal_rate 360
+#               python3 surrogate.py suggest
+
+import argparse, itertools, json, sys
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from Utilities import populate_parser
+from ResultsStore import ResultsStore, DEFAULT_DB
+
+DEFAULT_INPUTS = ["cat_removal_rate", "house_willingness", "car_hit_prob"]
+OUTPUTS = ["Cat Pop.", "Mice Pop.", "Cat Fights", "Cats Hit"]
+# Parameters that do not affect the simulated outcomes
+OUTPUT_NEUTRAL_PARAMS = ["save_out", "save_frequency", "record_trajectories",
+    "trajectory_frequency"]
+MODEL_FILE = "Results/surrogate.npz"
+# Added to the kernel diagonal for numerical stability
+JITTER = 1e-8
+
+def load_final_values(db_path=DEFAULT_DB):
+    # Imported here so that queries (which only need the saved model) stay fast
+    import pandas as pd
+    store = ResultsStore(db_path)
+    final_values = pd.DataFrame(store.get_final_values())
+    store.close()
+    if final_values.empty:
+        raise ValueError("No batch run results stored in " + db_path)
+    return final_values
+
+# The surrogate only varies over its inputs, so it is fit to the simulations
+# run with the same (baseline) values of every other parameter, and for the
+# same number of steps; anything else would be averaged in as if it were a
+# replication, as would runs of different engines. If max_steps (or engine) is
+# None, the matching runs must all share one.
+def select_runs(final_values, sim_params, inputs, baseline, max_steps,
+    engine=None):
+    selected = final_values
+    for k,v in baseline.items():
+        if k in inputs or k in OUTPUT_NEUTRAL_PARAMS:
+            continue
+        if k in selected:
+            # Runs stored before a parameter existed ran with its default
+            matches = np.isclose(selected[k].fillna(
+                sim_params[k]["value"]).astype(float), float(v))
+        else:
+            matches = np.isclose(float(sim_params[k]["value"]), float(v))
+        selected = selected[matches]
+    if max_steps is not None:
+        selected = selected[selected["max_steps"] == max_steps]
+    if engine is not None:
+        selected = selected[selected["engine"] == engine]
+    if selected.empty:
+        raise ValueError("No stored runs match the baseline parameters" +
+            ("" if max_steps is None else ", max_steps " + str(max_steps)) +
+            ("" if engine is None else ", engine " + engine))
+    if selected["max_steps"].nunique() > 1:
+        raise ValueError("The matching runs were run for different numbers " +
+            "of steps (" + ", ".join([str(s) for s in
+            sorted(selected["max_steps"].unique())]) +
+            "); choose one with --max_steps")
+    if selected["engine"].nunique() > 1:
+        raise ValueError("The matching runs were run with different " +
+            "engines (" + ", ".join(sorted(selected["engine"].unique())) +
+            "); choose one with --engine")
+    return selected
+
+# @return Design points, the mean of each output there, the squared standard
+#         error of that mean (its known noise variance) and the pooled variance
+#         of a single simulation's output across replications
+def get_design_points(final_values, inputs, outputs):
+    # Replications at the same parameter point are reduced to their mean
+    grouped = final_values.groupby(inputs)[outputs]
+    means = grouped.mean()
+    variances = grouped.var().fillna(0).to_numpy(dtype=float)
+    counts = grouped.count().to_numpy(dtype=float)
+    degrees = np.maximum(counts - 1, 0)
+    replication_var = (degrees * variances).sum(axis=0) / \
+        np.maximum(degrees.sum(axis=0), 1)
+    x = means.index.to_frame(index=False).to_numpy(dtype=float)
+    return x, means.to_numpy(dtype=float), variances / counts, replication_var
+
+# Basis of the mean term: a constant, plus a linear trend in each input when
+# there are enough design points to estimate one
+def get_basis(x, linear):
+    return np.hstack([np.ones((x.shape[0], 1)), x]) if linear else \
+        np.ones((x.shape[0], 1))
+
+def rbf_kernel(x1, x2, length_scales, signal_var):
+    diff = (x1[:, None, :] - x2[None, :, :]) / length_scales
+    return signal_var * np.exp(-0.5 * np.sum(diff ** 2, axis=-1))
+
+def unpack_hyperparameters(theta, num_inputs):
+    # All hyperparameters are optimized on the log scale
+    return (np.exp(theta[:num_inputs]), np.exp(theta[num_inputs]),
+        np.exp(theta[num_inputs + 1]))
+
+# Restricted likelihood (the mean term's coefficients integrated out under a
+# flat prior), up to a constant
+def neg_log_likelihood(theta, x, y, noise, h):
+    length_scales, signal_var, nugget = unpack_hyperparameters(theta,
+        x.shape[1])
+    k = rbf_kernel(x, x, length_scales, signal_var) + \
+        np.diag(noise + nugget + JITTER)
+    try:
+        chol = cho_factor(k, lower=True)
+        h_chol = cho_factor(h.T @ cho_solve(chol, h), lower=True)
+    except np.linalg.LinAlgError:
+        return 1e10
+    beta = cho_solve(h_chol, h.T @ cho_solve(chol, y))
+    r = y - (h @ beta)
+    return 0.5 * (r @ cho_solve(chol, r)) + \
+        np.sum(np.log(np.diag(chol[0]))) + np.sum(np.log(np.diag(h_chol[0])))
+
+class GaussianProcessSurrogate:
+    # @param lower, upper Parameter ranges (from simulation_params.json) used
+    #        to scale all inputs to [0, 1]
+    # @param conditions The values of every other parameter (and max_steps)
+    #        of the simulations the surrogate is fit to
+    def __init__(self, inputs, outputs, lower, upper, conditions={}):
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.conditions = dict(conditions)
+
+    def scale(self, x):
+        return (np.asarray(x, dtype=float) - self.lower) / \
+            np.where(self.upper > self.lower, self.upper - self.lower, 1)
+
+    # Universal kriging: the outputs are a mean term (get_basis) with unknown
+    # coefficients plus a Gaussian process, observed with the replication
+    # noise of each design point and a fitted nugget
+    # @param replication_var Variance of a single simulation's outputs
+    def fit(self, x, y, noise, replication_var):
+        from scipy.optimize import minimize
+        self.x = self.scale(x)
+        n, d = self.x.shape
+        self.linear_mean = n >= d + 3
+        h = get_basis(self.x, self.linear_mean)
+        # Put each output on the scale of its spread, counting the replication
+        # noise, so that an output with equal means is still scaled by its
+        # noise
+        self.y_scale = np.sqrt(y.var(axis=0) + noise.mean(axis=0))
+        # An output that every simulation gave the same value (e.g. Cats Hit
+        # with no cars) has nothing to fit: it is predicted as that constant,
+        # with no uncertainty
+        self.constant = self.y_scale == 0
+        self.y_scale[self.constant] = 1
+        y = y / self.y_scale
+        noise = noise / (self.y_scale ** 2)
+        self.replication_var = replication_var / (self.y_scale ** 2)
+
+        bounds = [(np.log(0.01), np.log(10))] * d + \
+            [(np.log(1e-3), np.log(1e2)), (np.log(1e-8), np.log(10))]
+        self.theta = np.zeros((len(self.outputs), d + 2))
+        self.chol = np.zeros((len(self.outputs), n, n))
+        self.alpha = np.zeros((len(self.outputs), n))
+        self.beta = np.zeros((len(self.outputs), h.shape[1]))
+        # Covariance of the estimated coefficients, (H^T K^-1 H)^-1
+        self.beta_cov = np.zeros((len(self.outputs), h.shape[1], h.shape[1]))
+        for j in range(len(self.outputs)):
+            if self.constant[j]:
+                self.beta[j][0] = y[0, j]
+                continue
+            theta0 = np.concatenate([np.log(np.full(d, 0.3)), [0.0],
+                [np.log(0.1)]])
+            res = minimize(neg_log_likelihood, theta0,
+                args=(self.x, y[:, j], noise[:, j], h), method="L-BFGS-B",
+                bounds=bounds)
+            self.theta[j] = res.x
+            length_scales, signal_var, nugget = unpack_hyperparameters(res.x,
+                d)
+            k = rbf_kernel(self.x, self.x, length_scales, signal_var) + \
+                np.diag(noise[:, j] + nugget + JITTER)
+            self.chol[j] = np.linalg.cholesky(k)
+            k_inv_h = cho_solve((self.chol[j], True), h)
+            self.beta_cov[j] = np.linalg.inv(h.T @ k_inv_h)
+            self.beta[j] = self.beta_cov[j] @ (k_inv_h.T @ y[:, j])
+            self.alpha[j] = cho_solve((self.chol[j], True),
+                y[:, j] - (h @ self.beta[j]))
+        return self
+
+    def predict(self, x, simulation=False):
+        """Predictive mean and standard deviation of each output (columns
+        follow self.outputs) at the given points. The standard deviation is
+        that of the expected value, including the uncertainty in the mean
+        term, or with simulation=True that of a single new simulation's
+        output, which adds the nugget and the replication noise."""
+        x = np.atleast_2d(self.scale(x))
+        h = get_basis(self.x, self.linear_mean)
+        h_star = get_basis(x, self.linear_mean)
+        mean = np.zeros((x.shape[0], len(self.outputs)))
+        var = np.zeros((x.shape[0], len(self.outputs)))
+        for j in range(len(self.outputs)):
+            if self.constant[j]:
+                mean[:, j] = self.beta[j][0]
+                continue
+            length_scales, signal_var, nugget = unpack_hyperparameters(
+                self.theta[j], x.shape[1])
+            k_star = rbf_kernel(x, self.x, length_scales, signal_var)
+            mean[:, j] = (h_star @ self.beta[j]) + (k_star @ self.alpha[j])
+            v = solve_triangular(self.chol[j], k_star.T, lower=True)
+            r = h_star.T - (h.T @ cho_solve((self.chol[j], True), k_star.T))
+            var[:, j] = np.maximum(signal_var - np.sum(v ** 2, axis=0), 0) + \
+                np.sum(r * (self.beta_cov[j] @ r), axis=0)
+            if simulation:
+                var[:, j] += nugget + self.replication_var[j]
+        return mean * self.y_scale, np.sqrt(var) * self.y_scale
+
+    def suggest(self, candidates, k=5):
+        """The k candidate points where the surrogate is least certain
+        (largest scaled predictive standard deviation of the expected
+        value)."""
+        _, sd = self.predict(candidates)
+        uncertainty = np.max(sd / self.y_scale, axis=1)
+        best = np.argsort(-uncertainty)[:k]
+        return np.asarray(candidates)[best], uncertainty[best]
+
+    def save(self, path=MODEL_FILE):
+        np.savez(path, inputs=self.inputs, outputs=self.outputs,
+            lower=self.lower, upper=self.upper,
+            conditions=json.dumps(self.conditions), x=self.x,
+            linear_mean=self.linear_mean, constant=self.constant,
+            y_scale=self.y_scale,
+            replication_var=self.replication_var, theta=self.theta,
+            chol=self.chol, alpha=self.alpha, beta=self.beta,
+            beta_cov=self.beta_cov)
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        with np.load(path) as f:
+            model = cls(f["inputs"].tolist(), f["outputs"].tolist(),
+                f["lower"], f["upper"], json.loads(str(f["conditions"])))
+            for attr in ["x", "constant", "y_scale", "replication_var",
+                "theta", "chol", "alpha", "beta", "beta_cov"]:
+                setattr(model, attr, f[attr])
+            model.linear_mean = bool(f["linear_mean"])
+        return model
+
+def get_candidates(sim_params, inputs):
+    # Every combination of values reachable with the JSON sliders
+    axes = [np.arange(sim_params[k]["min_value"],
+        sim_params[k]["max_value"] + (sim_params[k]["step"] / 2),
+        sim_params[k]["step"]) for k in inputs]
+    return np.array(list(itertools.product(*axes)))
+
+if __name__ == "__main__":
+    # Read in JSON file with simulation parameters
+    with open("simulation_params.json", "r") as f:
+        sim_params = json.load(f)
+    sliders = {k : v for k,v in sim_params.items() if v["type"] == "Slider"}
+
+    parser = argparse.ArgumentParser(
+        description="Fit and query a surrogate of the Cat ABM simulation")
+    parser.add_argument("--model_file", default=MODEL_FILE,
+        help="Where the fitted surrogate is saved")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit",
+        help="Fit the surrogate to the stored batch run results")
+    fit_parser.add_argument("--inputs", nargs="+", default=DEFAULT_INPUTS,
+        choices=list(sliders), help="Parameters the surrogate varies over")
+    fit_parser.add_argument("--results_db", default=DEFAULT_DB,
+        help="SQLite database holding the batch run results")
+    fit_parser.add_argument("--max_steps", type=int, default=None,
+        help="Only use runs of this many steps (required if the matching " +
+        "runs differ)")
+    fit_parser.add_argument("--engine", choices=["reference", "ensemble"],
+        default=None, help="Only use runs of this engine (required if the " +
+        "matching runs differ)")
+    # Only runs with these values of the other parameters are used
+    populate_parser(fit_parser, sim_params)
+
+    query_parser = subparsers.add_parser("query",
+        help="Predict the outputs at a parameter point")
+    # Parameters not specified default to their JSON values
+    populate_parser(query_parser, sliders)
+
+    suggest_parser = subparsers.add_parser("suggest",
+        help="Suggest the next parameter points to simulate")
+    suggest_parser.add_argument("--number_points", type=int, default=5,
+        help="How many parameter points to suggest")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        baseline = {k : getattr(args, k) if hasattr(args, k) else
+            getattr(args, "no_" + k) for k in sim_params}
+        try:
+            final_values = select_runs(load_final_values(args.results_db),
+                sim_params, args.inputs, baseline, args.max_steps,
+                args.engine)
+        except ValueError as e:
+            sys.exit(str(e))
+        conditions = {k : v for k,v in baseline.items()
+            if k not in args.inputs and k not in OUTPUT_NEUTRAL_PARAMS}
+        conditions["max_steps"] = int(final_values["max_steps"].iloc[0])
+        conditions["engine"] = final_values["engine"].iloc[0]
+        x, y, noise, replication_var = get_design_points(final_values,
+            args.inputs, OUTPUTS)
+        surrogate = GaussianProcessSurrogate(args.inputs, OUTPUTS,
+            [sliders[k]["min_value"] for k in args.inputs],
+            [sliders[k]["max_value"] for k in args.inputs],
+            conditions).fit(x, y, noise, replication_var)
+        surrogate.save(args.model_file)
+        print("Fit to " + str(x.shape[0]) + " parameter points (" +
+            str(final_values.shape[0]) + " " + conditions["engine"] +
+            " simulations of " + str(conditions["max_steps"]) + " steps)")
+    elif args.command == "query":
+        surrogate = GaussianProcessSurrogate.load(args.model_file)
+        point = [getattr(args, k) for k in surrogate.inputs]
+        mean, sd = surrogate.predict(point)
+        _, simulation_sd = surrogate.predict(point, simulation=True)
+        for k,v in zip(surrogate.inputs, point):
+            print(k + " = " + str(v))
+        # What the surrogate holds fixed
+        print("(with " + ", ".join([k + " = " + str(v) for k,v in
+            surrogate.conditions.items()]) + ")")
+        print()
+        for j, stat in enumerate(surrogate.outputs):
+            print(stat + " Mean: " + str(round(mean[0, j], 2)) + " (SD " +
+                str(round(sd[0, j], 2)) + "; one simulation: SD " +
+                str(round(simulation_sd[0, j], 2)) + ")")
+    elif args.command == "suggest":
+        surrogate = GaussianProcessSurrogate.load(args.model_file)
+        points, uncertainty = surrogate.suggest(
+            get_candidates(sliders, surrogate.inputs), args.number_points)
+        # Run under the same conditions as the simulations fit to
+        fixed = ["--max_steps " + str(surrogate.conditions["max_steps"]),
+            "--engine " + surrogate.conditions["engine"]]
+        for k,v in surrogate.conditions.items():
+            if k in sim_params and v != sim_params[k]["value"]:
+                fixed.append(("--" + k if v else "--no_" + k) if
+                    sim_params[k]["type"] == "Checkbox" else
+                    "--" + k + " " + str(v))
+        for point, u in zip(points, uncertainty):
+            # Match the argument types batch_run.py expects
+            print("python3 batch_run.py " + " ".join(fixed + ["--" + k + " " +
+                str(type(sliders[k]["value"])(round(v, 6)))
+                for k,v in zip(surrogate.inputs, point)]) +
+                "    # uncertainty: " + str(round(u, 3)))
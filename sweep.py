@@ -0,0 +1,299 @@
+# File:         sweep.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the sharded parameter sweeps, for sweeps
+#               too large for one machine. A sweep lives in a shared directory
+#               (e.g. on a network filesystem): "plan" writes its manifest and
+#               splits it into shards (by parameter set and seed range),
+#               "work" runs shards on any number of machines, each claiming
+#               them through atomic renames, and "merge" combines the results
+#               into the results store, with the usual plots and confidence
+#               intervals. No other service is needed.
+# Run:          python3 sweep.py plan sweep_dir --sweep num_cats=10,20,40
+#               python3 sweep.py work sweep_dir --processes 4
+#               python3 sweep.py merge sweep_dir
+
+import argparse, itertools, json, multiprocessing, os, socket, sys, time
+from Utilities import populate_parser, check_args
+from ResultsStore import DEFAULT_DB
+
+# Shard life cycle (one file per shard, moved between directories):
+# pending -> claimed -> (result written to results, claim removed)
+# Moves are renames within the sweep directory, which are atomic, so exactly
+# one worker claims each shard. A claim's age is its modification time, which
+# a rename keeps: shards are touched just before being claimed (so a claim's
+# age counts from its claim, not from planning) and claims are touched as
+# simulations complete. A claim not touched for a while (e.g. its worker
+# died) is moved back to pending by the next worker that notices.
+PENDING, CLAIMED, RESULTS, TMP = "pending", "claimed", "results", "tmp"
+MANIFEST = "manifest.json"
+# Seconds between checks for work while other workers hold the last claims
+POLL_INTERVAL = 5
+
+# A --sweep value of a parameter, typed as in simulation_params.json
+def parse_value(name, param, value):
+    if param["type"] == "Checkbox":
+        if value.lower() in ["true", "1"]:
+            return True
+        if value.lower() in ["false", "0"]:
+            return False
+        expected = "true or false"
+    else:
+        value_type = type(param["value"])
+        try:
+            return value_type(value)
+        except ValueError:
+            expected = "an integer" if value_type is int else "a number"
+    raise ValueError("Invalid value " + value + " for " + name +
+        " (expected " + expected + ")")
+
+def get_path(directory, *parts):
+    return os.path.join(directory, *parts)
+
+def write_json(directory, path, data):
+    # Written elsewhere and then renamed, so readers never see partial files
+    tmp_path = get_path(directory, TMP, socket.gethostname() + "_" +
+        str(os.getpid()) + "_" + os.path.basename(path))
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, default=lambda v : v.item()) # NumPy scalars
+    os.replace(tmp_path, path)
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+# PLAN
+# @param param_sets List of simulation parameter dictionaries
+# @param runs List of (iteration, seed), run for every parameter set
+def plan(directory, param_sets, runs, runs_per_shard, settings):
+    for sub_dir in [PENDING, CLAIMED, RESULTS, TMP]:
+        os.makedirs(get_path(directory, sub_dir), exist_ok=True)
+    if os.path.exists(get_path(directory, MANIFEST)):
+        sys.exit(directory + " already holds a sweep")
+
+    shards = []
+    for p in range(len(param_sets)):
+        for start in range(0, len(runs), runs_per_shard):
+            shards.append({"id" : "p" + str(p).zfill(4) + "_r" +
+                str(start).zfill(6), "param_set" : p,
+                # Run ids are unique within a parameter set
+                "runs" : [(run_id, iteration, seed) for run_id,
+                    (iteration, seed) in enumerate(runs[start : start +
+                    runs_per_shard], start)]})
+    for shard in shards:
+        write_json(directory, get_path(directory, PENDING,
+            shard["id"] + ".json"), shard)
+    # The manifest is written last; workers wait for it
+    write_json(directory, get_path(directory, MANIFEST), {**settings,
+        "param_sets" : param_sets, "shards" : [s["id"] for s in shards]})
+    return shards
+
+# WORK
+def run_shard(directory, manifest, shard, claim_path):
+    # Imported here so that planning and merging do not need the model
+    from worker_daemon import run_simulation
+    params = manifest["param_sets"][shard["param_set"]]
+    max_steps = manifest["max_steps"]
+    period = manifest["data_collection_period"]
+    if manifest["engine"] == "ensemble":
+        from EnsembleModel import EnsembleModel
+        model = EnsembleModel(**params,
+            seeds=[seed for _, _, seed in shard["runs"]])
+        model.run(max_steps)
+        rows = model.get_batch_results(params, period)
+        for row in rows:
+            run_id, iteration, _ = shard["runs"][row["RunId"]]
+            row["RunId"], row["iteration"] = run_id, iteration
+        return rows
+
+    rows = []
+    for run_id, iteration, seed in shard["runs"]:
+        rows += run_simulation((run_id, iteration, dict(params, seed=seed),
+            max_steps, period))
+        try:
+            os.utime(claim_path) # Still working on it
+        except FileNotFoundError: # Reclaimed (we were too slow); carry on
+            pass
+    return rows
+
+def reclaim_stale(directory, stale_after):
+    now = time.time()
+    for name in os.listdir(get_path(directory, CLAIMED)):
+        claim_path = get_path(directory, CLAIMED, name)
+        try:
+            stale = now - os.path.getmtime(claim_path) > stale_after
+            if stale and not os.path.exists(get_path(directory, RESULTS,
+                name)):
+                os.rename(claim_path, get_path(directory, PENDING, name))
+                print("Reclaimed stale shard " + name[:-5])
+        except FileNotFoundError: # Finished or reclaimed meanwhile
+            pass
+
+def work(directory, stale_after):
+    while not os.path.exists(get_path(directory, MANIFEST)):
+        time.sleep(POLL_INTERVAL)
+    manifest = read_json(get_path(directory, MANIFEST))
+    worker = socket.gethostname() + ":" + str(os.getpid())
+    completed = 0
+    while True:
+        reclaim_stale(directory, stale_after)
+        pending = sorted(os.listdir(get_path(directory, PENDING)))
+        if not pending:
+            if not os.listdir(get_path(directory, CLAIMED)):
+                break # Sweep complete
+            time.sleep(POLL_INTERVAL) # Others' claims may yet go stale
+            continue
+        for name in pending:
+            pending_path = get_path(directory, PENDING, name)
+            claim_path = get_path(directory, CLAIMED, name)
+            try:
+                os.utime(pending_path) # The claim's age counts from now
+                os.rename(pending_path, claim_path)
+                shard = read_json(claim_path)
+            except FileNotFoundError: # Another worker claimed it first
+                continue
+            rows = run_shard(directory, manifest, shard, claim_path)
+            write_json(directory, get_path(directory, RESULTS, name), rows)
+            try:
+                os.remove(claim_path)
+            except FileNotFoundError:
+                pass
+            completed += 1
+            print(worker + " completed shard " + shard["id"])
+            break
+    return completed
+
+# MERGE
+def merge(directory, results_db):
+    import pandas as pd
+    from batch_run import save_results
+    from results import get_pop_plot
+
+    manifest = read_json(get_path(directory, MANIFEST))
+    missing = [s for s in manifest["shards"] if not os.path.exists(
+        get_path(directory, RESULTS, s + ".json"))]
+    if missing:
+        sys.exit(str(len(missing)) + " of " + str(len(manifest["shards"])) +
+            " shards have no results yet (e.g. " + missing[0] + ")")
+
+    results = {}
+    for shard_id in manifest["shards"]:
+        p = int(shard_id[1:shard_id.index("_")])
+        results.setdefault(p, []).extend(read_json(get_path(directory,
+            RESULTS, shard_id + ".json")))
+
+    merged = []
+    for p, params in enumerate(manifest["param_sets"]):
+        res_df = pd.DataFrame(results[p]).sort_values(["RunId", "Step"])
+        run_id, n, conf_dict = save_results(res_df, "RunId", params,
+            manifest["arguments"], manifest["max_steps"],
+            manifest["significance_level"], results_db, manifest["engine"])
+        get_pop_plot(results_db, run_id, "Cat")
+        get_pop_plot(results_db, run_id, "Mice")
+        merged.append((run_id, params, n, conf_dict))
+    return merged
+
+if __name__ == "__main__":
+    # Read in JSON file with simulation parameters
+    with open("simulation_params.json", "r") as f:
+        sim_params = json.load(f)
+
+    parser = argparse.ArgumentParser(
+        description="Run a Cat ABM parameter sweep across machines")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan",
+        help="Write a sweep's manifest and shards")
+    plan_parser.add_argument("directory", help="Shared sweep directory")
+    # Pull simulation arguments from JSON file
+    populate_parser(plan_parser, sim_params)
+    plan_parser.add_argument("--sweep", action="append", default=[],
+        metavar="PARAM=V1,V2,...", help="Values of a parameter to sweep " +
+        "over (repeat for a grid over several parameters)")
+    # Same batch running arguments as batch_run.py
+    plan_parser.add_argument("--iterations", type=int, default=1,
+        help="Number of times to run for each combination of parameters")
+    plan_parser.add_argument("--data_collection_period", type=int,
+        default=96, help="How many steps in between collection " +
+        "(-1 = only at end)")
+    plan_parser.add_argument("--max_steps", type=int, default=1000,
+        help="How many steps to run the simulation")
+    plan_parser.add_argument("--repro_iter", type=int, default=10,
+        help="Use this to set how many unique seeds to use")
+    plan_parser.add_argument("--seed", type=int, default=1234,
+        help="Seed for reproducibility")
+    plan_parser.add_argument("--significance_level", type=float,
+        default=0.05, help="Significance level for confidence interval " +
+        "estimation")
+    plan_parser.add_argument("--engine", choices=["reference", "ensemble"],
+        default="reference", help="Engine the workers run shards with")
+    plan_parser.add_argument("--runs_per_shard", type=int, default=5,
+        help="Simulations (seeds) per shard")
+
+    work_parser = subparsers.add_parser("work",
+        help="Claim and run shards until the sweep is complete")
+    work_parser.add_argument("directory", help="Shared sweep directory")
+    work_parser.add_argument("--processes", type=int, default=1,
+        help="Number of worker processes on this machine")
+    work_parser.add_argument("--stale_after", type=float, default=600,
+        help="Seconds after which an untouched claim is taken to be " +
+        "abandoned (must exceed the time one simulation takes, or one " +
+        "shard with the ensemble engine)")
+
+    merge_parser = subparsers.add_parser("merge",
+        help="Combine a complete sweep's results into the results store")
+    merge_parser.add_argument("directory", help="Shared sweep directory")
+    merge_parser.add_argument("--results_db", default=DEFAULT_DB,
+        help="SQLite database in which to store the results")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        args_sim_params = {k : v for k,v in vars(args).items()
+            if k in sim_params}
+        sweeps = {}
+        for sweep in args.sweep:
+            name, values = sweep.split("=")
+            if name not in sim_params:
+                sys.exit("Unknown parameter " + name)
+            try:
+                sweeps[name] = [parse_value(name, sim_params[name], v)
+                    for v in values.split(",")]
+            except ValueError as e:
+                sys.exit(str(e))
+        param_sets = [dict(args_sim_params, **dict(zip(sweeps, values)))
+            for values in itertools.product(*sweeps.values())]
+        for params in param_sets:
+            check_args(params, sim_params)
+
+        seeds = list(range(args.seed, args.seed + args.repro_iter)) \
+            if args.repro_iter else [None]
+        runs = [(i, seed) for i in range(args.iterations) for seed in seeds]
+        shards = plan(args.directory, param_sets, runs, args.runs_per_shard,
+            {"arguments" : vars(args), "max_steps" : args.max_steps,
+             "data_collection_period" : args.data_collection_period,
+             "significance_level" : args.significance_level,
+             "engine" : args.engine, "swept" : list(sweeps)})
+        print("Planned " + str(len(param_sets)) + " parameter sets x " +
+            str(len(runs)) + " simulations as " + str(len(shards)) +
+            " shards in " + args.directory)
+    elif args.command == "work":
+        if args.processes > 1:
+            with multiprocessing.Pool(args.processes) as pool:
+                completed = sum(pool.starmap(work, [(args.directory,
+                    args.stale_after)] * args.processes))
+        else:
+            completed = work(args.directory, args.stale_after)
+        print("Sweep complete (" + str(completed) + " shards run here)")
+    elif args.command == "merge":
+        os.makedirs(os.path.dirname(args.results_db) or ".", exist_ok=True)
+        swept = read_json(get_path(args.directory, MANIFEST))["swept"]
+        for run_id, params, n, conf_dict in merge(args.directory,
+            args.results_db):
+            print("Run " + str(run_id) + " " + ", ".join([k + "=" +
+                str(params[k]) for k in swept]) + " (" + str(n) +
+                " simulations)")
+            for k,v in conf_dict.items():
+                print("    " + k + " Mean: " + str(v["Mean"]) + " (" +
+                    str(v["Lower"]) + "," + str(v["Upper"]) + ")")
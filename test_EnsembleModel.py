@@ -0,0 +1,66 @@
+# File:         test_EnsembleModel.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the tests of the ensemble engine
+#               (EnsembleModel.py): that a replication's results do not depend
+#               on the replications run with it, and that meals are limited as
+#               in the reference (one per house per tick, no more catches than
+#               a restaurant has mice).
+# Run:          python3 -m pytest test_EnsembleModel.py
+
+import json, os
+import numpy as np
+from EnsembleModel import EnsembleModel, HOUSE, RESTAURANT
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_STEPS = 300
+
+def get_params(**changes):
+    with open(os.path.join(REPO_DIR, "simulation_params.json"), "r") as f:
+        sim_params = json.load(f)
+    return dict({k : v["value"] for k,v in sim_params.items()}, **changes)
+
+def get_series(seeds, seed, params):
+    model = EnsembleModel(**params, seeds=seeds)
+    model.run(MAX_STEPS)
+    r = seeds.index(seed)
+    return {k : [values[r] for values in v]
+        for k,v in model.model_vars.items()}
+
+def test_replications_independent():
+    params = get_params(num_cats=30, house_willingness=0.5)
+    alone = get_series([6], 6, params)
+    assert get_series([5, 6, 7], 6, params) == alone
+    assert get_series([7, 6, 100, 101, 102], 6, params) == alone
+
+# Records the meals of every tick: cats hungry before act() and fed by it
+class MealRecordingModel(EnsembleModel):
+    def act(self):
+        c = self.cats
+        hungry = c["alive"] & c["is_hungry"]
+        mice_pop = self.mice_pop.copy()
+        contended = self.found_food & hungry
+        keys = self.cell_key(c["x"], c["y"])
+        self.contention += np.bincount(keys[contended]).max(initial=0) > 1
+        super().act()
+        fed = hungry & c["alive"] & ~c["is_hungry"]
+        cell = self.cell_type[self.rep_idx, c["x"], c["y"]]
+        num_cells = self.num_reps * self.width * self.height
+        house_meals = np.bincount(keys[fed & (cell == HOUSE)],
+            minlength=num_cells)
+        assert house_meals.max() <= 1
+        catches = np.bincount(keys[fed & (cell == RESTAURANT)],
+            minlength=num_cells)
+        assert (catches <= mice_pop.reshape(-1)).all()
+        assert (mice_pop.reshape(-1) - self.mice_pop.reshape(-1) ==
+            catches).all()
+
+def test_meal_limits():
+    model = MealRecordingModel(**get_params(num_cats=150, house_willingness=1,
+        initial_mice_pop=0, mouse_growth_rate=0), seeds=[1, 2, 3])
+    model.contention = 0
+    model.run(MAX_STEPS)
+    # Cats did compete for the same food
+    assert model.contention > 0
@@ -0,0 +1,75 @@
+# File:         test_Utilities.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the unit tests of the steady-state helpers
+#               (MSER truncation and trend detection) in Utilities.py.
+# Run:          python3 -m pytest test_Utilities.py
+
+import random
+from Utilities import get_mser_truncation, has_trend, is_steady_state, \
+    MSER_MIN_KEPT, TREND_MIN_POINTS
+
+BATCH_SIZE = 96
+
+def get_series(num_batches, level, slope=0, warm_up=0, seed=1234):
+    # Noisy series of num_batches batches: a linear warm-up from 0 over the
+    # first warm_up batches, then level plus slope per batch
+    rng = random.Random(seed)
+    series = []
+    for i in range(num_batches * BATCH_SIZE):
+        batch = i / BATCH_SIZE
+        mean = level * (batch / warm_up) if batch < warm_up else \
+            level + (slope * batch)
+        series.append(mean + rng.gauss(0, 5))
+    return series
+
+def get_batch_means(series):
+    return [sum(series[i : i + BATCH_SIZE]) / BATCH_SIZE
+        for i in range(0, len(series), BATCH_SIZE)]
+
+def test_mser_truncates_warm_up():
+    batch_means = get_batch_means(get_series(40, 100, warm_up=8))
+    d = get_mser_truncation(batch_means)
+    assert 6 <= d <= 12
+
+def test_mser_keeps_minimum():
+    batch_means = get_batch_means(get_series(10, 100, slope=3))
+    assert get_mser_truncation(batch_means) <= 10 - MSER_MIN_KEPT
+
+def test_trend_detected():
+    assert has_trend(get_batch_means(get_series(20, 100, slope=2)))
+    assert has_trend(get_batch_means(get_series(20, 100, slope=-2)))
+    assert not has_trend(get_batch_means(get_series(20, 100)))
+
+def test_trending_series_not_steady():
+    # Still climbing (as the mice populations do with the default
+    # parameters), however long it runs
+    for num_batches in [5, 10, 20, 40, 60]:
+        assert not is_steady_state(get_series(num_batches, 70, slope=5),
+            BATCH_SIZE, 5)
+
+def test_staircase_series_not_steady():
+    # Flat for a few batches, then a step up: the last few batches alone
+    # look stationary
+    series = get_series(20, 60)
+    series = [v + (12 * ((i // BATCH_SIZE) // 3)) for i, v in
+        enumerate(series)]
+    for num_batches in [10, 15, 20]:
+        assert not is_steady_state(series[:num_batches * BATCH_SIZE],
+            BATCH_SIZE, 5)
+
+def test_stationary_series_steady():
+    assert is_steady_state(get_series(20, 100), BATCH_SIZE, 5)
+    assert is_steady_state(get_series(40, 100, warm_up=8), BATCH_SIZE, 5)
+
+def test_short_series_not_judged():
+    # Not until there are twice as many batches as must be kept (a constant
+    # series, so that only its length matters)
+    for min_batches in [5, 15]:
+        num_batches = 2 * max(min_batches, TREND_MIN_POINTS)
+        assert not is_steady_state([100] * ((num_batches - 1) * BATCH_SIZE),
+            BATCH_SIZE, min_batches)
+        assert is_steady_state([100] * (num_batches * BATCH_SIZE),
+            BATCH_SIZE, min_batches)
@@ -0,0 +1,61 @@
+# File:         test_sweep.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains the test of the sharded parameter sweeps
+#               (sweep.py): a small sweep planned, worked by several processes
+#               on this machine, and merged.
+# Run:          python3 -m pytest test_sweep.py
+
+import json, multiprocessing, os, shutil
+import sweep
+from sweep import plan, work, merge, read_json, get_path, PENDING, CLAIMED, \
+    RESULTS
+from ResultsStore import ResultsStore
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+NUM_WORKERS = 3
+
+def test_plan_work_merge(tmp_path, monkeypatch):
+    # Merging reads simulation_params.json and saves plots to Results/, both
+    # in the working directory
+    shutil.copy(os.path.join(REPO_DIR, "simulation_params.json"), tmp_path)
+    os.makedirs(tmp_path / "Results")
+    monkeypatch.chdir(tmp_path)
+    # Workers waiting on others' last claims need not wait long
+    monkeypatch.setattr(sweep, "POLL_INTERVAL", 0.1)
+    with open("simulation_params.json", "r") as f:
+        sim_params = json.load(f)
+
+    params = {k : v["value"] for k,v in sim_params.items()}
+    param_sets = [dict(params, num_cats=n) for n in [10, 20]]
+    runs = [(0, seed) for seed in range(1234, 1240)]
+    directory = str(tmp_path / "sweep")
+    shards = plan(directory, param_sets, runs, 2, {"arguments" : {},
+        "max_steps" : 50, "data_collection_period" : 10,
+        "significance_level" : 0.05, "engine" : "reference",
+        "swept" : ["num_cats"]})
+
+    with multiprocessing.Pool(NUM_WORKERS) as pool:
+        completed = pool.starmap(work, [(directory, 600)] * NUM_WORKERS)
+    assert sum(completed) == len(shards)
+
+    # Every shard has exactly one result, covering its simulations
+    assert sorted(os.listdir(get_path(directory, RESULTS))) == \
+        sorted([shard["id"] + ".json" for shard in shards])
+    for shard in shards:
+        rows = read_json(get_path(directory, RESULTS, shard["id"] + ".json"))
+        assert {row["RunId"] for row in rows} == \
+            {run_id for run_id, _, _ in shard["runs"]}
+    assert not os.listdir(get_path(directory, PENDING))
+    assert not os.listdir(get_path(directory, CLAIMED))
+
+    db_path = str(tmp_path / "Results" / "results.db")
+    merged = merge(directory, db_path)
+    assert [n for _, _, n, _ in merged] == [len(runs)] * len(param_sets)
+    store = ResultsStore(db_path)
+    assert len(store.find_runs()) == len(param_sets)
+    for n in [10, 20]:
+        assert len(store.find_runs(num_cats=n)) == 1
+    store.close()
@@ -0,0 +1,124 @@
+# File:         worker_daemon.py
+# Authors:      Artjom Plaunov and Daniel Mallia
+# Class:        Modeling and Simulation (CSCI 74000)
+# Professor:    Professor Vazquez-Abad
+# Assignment:   Final Project
+# Description:  This file contains a long-lived local simulation service: a
+#               pool of warm worker processes (with the model already loaded)
+#               that runs simulation jobs submitted over a local socket (see
+#               submit.py) and streams the results back as they complete.
+#               Clients authenticate with a per-user key generated on first
+#               start (see Utilities.get_authkey).
+# Run:          python3 worker_daemon.py --number_processes 4
+
+import argparse, ipaddress, multiprocessing, socket, sys, threading, traceback
+from multiprocessing.connection import Listener
+import pandas as pd
+from CatModel import CatModel
+from batch_run import get_conf_intervals, save_results, CONF_STATS
+from Utilities import get_authkey, AUTHKEY_FILE
+
+DEFAULT_ADDRESS = ("localhost", 6174)
+
+# Runs a single simulation, returning the collected data in the same format as
+# mesa's batch_run (one dictionary per collected step)
+def run_simulation(run):
+    run_id, iteration, kwargs, max_steps, data_collection_period = run
+    model = CatModel(**kwargs, max_steps=max_steps)
+    while model.running and model.schedule.steps <= max_steps:
+        model.step()
+
+    model_vars = model.datacollector.model_vars
+    last_step = len(next(iter(model_vars.values()))) - 1
+    steps = list(range(0, last_step + 1, data_collection_period)) \
+        if data_collection_period > 0 else []
+    if not steps or steps[-1] != last_step:
+        steps.append(last_step)
+    return [{"RunId" : run_id, "iteration" : iteration, "Step" : step,
+        **kwargs, **{k : v[step] for k,v in model_vars.items()}}
+        for step in steps]
+
+# @param job Dictionary with the simulation "params", the "seeds" (one
+#        simulation per seed, None for unseeded), "max_steps",
+#        "data_collection_period", "significance_level" and whether to
+#        "store" the results in the results store
+def handle_job(pool, conn, job):
+    runs = [(run_id, iteration, dict(job["params"], seed=seed),
+        job["max_steps"], job["data_collection_period"])
+        for run_id, (iteration, seed) in enumerate(job["seeds"])]
+    results = []
+    for rows in pool.imap_unordered(run_simulation, runs):
+        results += rows
+        conn.send({"type" : "result", "final" : rows[-1]})
+
+    res_df = pd.DataFrame(results).sort_values(["RunId", "Step"])
+    if job["store"]:
+        run_id, _, conf_dict = save_results(res_df, "RunId", job["params"],
+            job, job["max_steps"], job["significance_level"])
+    else:
+        run_id = None
+        conf_dict = get_conf_intervals(res_df.groupby(["RunId"]).tail(1),
+            CONF_STATS, job["significance_level"])
+    conn.send({"type" : "done", "run_id" : run_id, "stats" : conf_dict})
+
+# Whether every address the host name resolves to is a loopback address
+def is_loopback(host):
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(info[4][0]).is_loopback
+        for info in infos)
+
+def serve_client(pool, conn):
+    try:
+        while True:
+            try:
+                job = conn.recv()
+            except EOFError: # Client disconnected
+                break
+            try:
+                handle_job(pool, conn, job)
+            except Exception:
+                conn.send({"type" : "error",
+                    "message" : traceback.format_exc()})
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a local Cat ABM simulation worker service")
+    parser.add_argument("--number_processes", type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of warm worker processes to keep")
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0],
+        help="Address to listen on (loopback only, unless --allow_remote)")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1],
+        help="Port to listen on")
+    parser.add_argument("--allow_remote", action="store_true",
+        help="Allow listening on a non-loopback address; any client with " +
+        "the key can then run code on this machine")
+    args = parser.parse_args()
+
+    if not args.allow_remote and not is_loopback(args.host):
+        sys.exit(args.host + " is not a loopback address; pass " +
+            "--allow_remote to listen on it anyway")
+    try:
+        authkey = get_authkey(AUTHKEY_FILE, create=True)
+    except PermissionError as e:
+        sys.exit(str(e))
+
+    with multiprocessing.Pool(args.number_processes) as pool, \
+        Listener((args.host, args.port), authkey=authkey) as listener:
+        print("Listening on " + args.host + ":" + str(args.port) + " with " +
+            str(args.number_processes) + " worker processes")
+        while True:
+            try:
+                conn = listener.accept()
+            except KeyboardInterrupt:
+                break
+            except Exception: # e.g. failed authentication
+                continue
+            # One thread per client; all share the same pool
+            threading.Thread(target=serve_client, args=(pool, conn),
+                daemon=True).start()